@@ -1,85 +1,382 @@
-from darknet_server.code.client import DarknetClient
+from datetime import datetime
+import collections
+import itertools
 import time
+import threading
 import multiprocessing
 import queue
 
-class AI:
+from detectors import get_detector
+from queues import put_drop_oldest
+from motion import MotionGate
+from scheduler import InferenceScheduler
+from shared_frames import SharedFramePool
+from tiling import Tiler, roi_region
+from util import camera_name
+import latency
+import metrics
+
+class Request:
+    # A frame sent to the detector that is waiting for its result
+    def __init__(self, seq, frame, deadline, roi=None):
+        self.seq = seq
+        self.frame = frame
+        self.deadline = deadline
+        self.roi = roi # normalized region of interest to crop to before inference
+        self.sent = time.time()
+        self.submitted = None # when the encoded images were handed to the workers
+        self.regions = None # pixel regions the images were cut from, when the frame was cropped or tiled
+
+class DetectorPool:
+    """
+    Detector worker processes and the queues feeding them. One pool can be shared by every camera
+    in a process (see supervisor.py); results are routed back to the camera that sent the request.
+    """
     def __init__(self, CONFIG):
+        self.detector = get_detector(CONFIG) # darknet server client or local OpenCV DNN
+        self.max_in_flight = self.detector.max_in_flight # frames being processed at once, across all cameras
+        # Frames are scaled to the network input size before encoding; the full resolution frame stays local.
+        # Detections are normalized (0-1) coordinates, so they apply to the full resolution frame unchanged.
+        self.input_size = self.detector.input_size
+        # Both queues are bounded; when full, the oldest entry is dropped (and counted) rather than blocking
+        self.image_queue = multiprocessing.Queue(2 * self.max_in_flight) # (seq, (slot, length) or images, image lengths, deadline) requests for the detector workers
+        self.boxes = multiprocessing.Queue(4 * self.max_in_flight) # (seq, detections per image, seconds per image) results from the detector workers
+        self.dropped_results = multiprocessing.Value("i", 0) # counted by the workers
+        self.heartbeat_timeout = CONFIG.get("ai_heartbeat_timeout", 10) # seconds a worker may go without a heartbeat
+        self.healthy = True
+        self.recovering = False # workers are beating again after a stall, but none has finished a request yet
+        self.debug = False
+        self.frame_pool = SharedFramePool(self.max_in_flight + 1, CONFIG.get("ai_slot_size", 8 * 1024 * 1024))
+        self.workers = [] # (process, heartbeat)
+        self.clients = [] # AI instances using this pool
+        self.seqs = itertools.count() # request IDs, unique across cameras
+        self.late = 0 # answers that arrived after their request was dropped
+        self.last_restart = 0
+        self.restart_workers()
+
+        metrics.collect("ai_queue_depth", self.queue_depth)
+        metrics.collect("ai_healthy", lambda: int(self.healthy))
+        metrics.collect("ai_workers", lambda: sum(worker.is_alive() for worker, heartbeat in self.workers))
+        metrics.collect("ai_results_late_total", lambda: self.late)
+        metrics.collect("ai_results_dropped_total", lambda: self.dropped_results.value)
+
+    def register(self, ai):
+        self.clients.append(ai)
+
+    def share(self):
+        # Requests each camera may have in flight, so one busy camera can't starve the others
+        return max(1, self.max_in_flight // max(1, len(self.clients)))
+
+    def owner(self, seq):
+        for ai in self.clients:
+            if seq in ai.in_flight:
+                return ai
+        return None
+
+    def restart_workers(self):
+        # (Re)start any detector workers that have exited, at most once a second so a crashing worker can't spin
+        self.workers = [(worker, heartbeat) for worker, heartbeat in self.workers if worker.is_alive()]
+        if len(self.workers) >= self.detector.workers or time.time() - self.last_restart < 1:
+            return
+        self.last_restart = time.time()
+        while len(self.workers) < self.detector.workers:
+            heartbeat = multiprocessing.Array("d", [time.time(), -1]) # last time the worker was responsive, request it's working on
+            worker = multiprocessing.Process(target=self.detector.run, args=[self.image_queue, self.boxes, self.frame_pool, heartbeat, self.dropped_results], daemon=True)
+            worker.start()
+            self.workers.append((worker, heartbeat))
+
+    def stop(self):
+        for worker in self.workers:
+            put_drop_oldest(self.image_queue, None) # send the halt command
+        time.sleep(0.1)
+        for worker, heartbeat in self.workers:
+            worker.terminate()
+            worker.join()
+        self.workers = []
+        self.frame_pool.close()
+
+    def check_heartbeats(self):
+        # Terminate workers that have stopped beating (e.g. stuck on a stalled server); restart_workers replaces them.
+        # Nothing here blocks: queued requests carry deadlines, so workers skip the stale ones on their own.
+        now = time.time()
+        for worker, heartbeat in self.workers:
+            if worker.is_alive() and now - heartbeat[0] > self.heartbeat_timeout:
+                if self.debug:
+                    print(f"AI: Worker {worker.pid} missed its heartbeat, restarting it")
+                worker.terminate()
+                ai = self.owner(int(heartbeat[1])) if heartbeat[1] >= 0 else None
+                if ai:
+                    ai.timeouts += 1
+                    ai.cancel(int(heartbeat[1])) # its answer is never coming
+        beating = any(worker.is_alive() and now - heartbeat[0] <= self.heartbeat_timeout for worker, heartbeat in self.workers)
+        if self.healthy and not beating:
+            print("AI: Detector stalled")
+            self.healthy = False
+        # A restarted worker beats straight away; only a finished request (see poll) makes the detector healthy again
+        self.recovering = not self.healthy and beating
+
+    def check_connection(self):
+        self.check_heartbeats()
+        self.restart_workers()
+
+    def submit(self, request):
+        for dropped in put_drop_oldest(self.image_queue, request):
+            if dropped is None:
+                continue # a halt command, only sent while stopping
+            # The detector is behind; the oldest waiting frame makes room for this one.
+            # No worker will see it, so its slot is free again
+            if isinstance(dropped[1], tuple):
+                self.frame_pool.release(dropped[1][0])
+            ai = self.owner(dropped[0])
+            if ai:
+                ai.dropped_requests += 1
+                ai.cancel(dropped[0])
+
+    def poll(self):
+        # Route finished results to the camera that sent the request
+        while not self.boxes.empty():
+            try:
+                result = self.boxes.get(False)
+            except queue.Empty:
+                break
+            if not self.healthy:
+                print("AI: Detector recovered")
+                self.healthy = True
+                self.recovering = False
+            ai = self.owner(result[0])
+            if ai is None:
+                self.late += 1
+                if self.debug:
+                    print(f"AI: Discarded late result for request {result[0]}")
+                continue
+            ai.results.append(result)
+
+    def queue_depth(self):
+        # Requests waiting for a free detector worker
+        try:
+            return self.image_queue.qsize()
+        except NotImplementedError: # macOS
+            return max(0, sum(len(ai.in_flight) for ai in self.clients) - self.detector.workers)
+
+    def status(self):
+        return {
+            "healthy": self.healthy,
+            "recovering": self.recovering,
+            "detector": self.detector.name,
+            "workers": len(self.workers),
+            "cameras": len(self.clients),
+            "queue_depth": self.queue_depth(),
+            "late": self.late,
+            "dropped_results": self.dropped_results.value,
+        }
+
+class AI:
+    def __init__(self, CONFIG, scheduler=None, pool=None):
         self.active = True
         self.debug = False
-        self.processing_image = False
-        self.image_queue = multiprocessing.Queue() # images sent get processed by the darknet server
-        self.local_image_queue = multiprocessing.Queue() # local copy of the images being sent to darknet
-        self.boxes = multiprocessing.Queue() # detections with bounding boxes
-        client = DarknetClient(CONFIG.get("image_server", "localhost"), CONFIG.get("image_server_port", 7061), self.image_queue, self.boxes)
-        self.image_process = multiprocessing.Process(target = DarknetClient.run, args=[client,])
-        self.image_process.start()
+        # Detector workers; shared between cameras when several run in one process
+        self.owns_pool = pool is None
+        self.pool = pool or DetectorPool(CONFIG)
+        self.pool.register(self)
+        self.detector = self.pool.detector
+        self.frame_pool = self.pool.frame_pool
+        self.input_size = self.pool.input_size
+        self.request_timeout = CONFIG.get("ai_timeout", 30)
+        self.tiler = Tiler(CONFIG, self.input_size) # optional tiled inference for small birds
+        self.tile_timings = [] # (region, seconds) for each tile of the last tiled result
+        self.results = collections.deque() # results routed to this camera by the pool
+        self.dropped_requests = 0
+
+        self.motion = MotionGate(CONFIG) # skips frames where nothing has changed
+        # Paces requests from activity and latency; shared between cameras when several run in one process
+        self.scheduler = scheduler or InferenceScheduler(CONFIG)
+        self.name = camera_name(CONFIG)
+        self.schedule = self.scheduler.register(self.name)
+
+        self.in_flight = dict() # seq -> Request
+        self.in_flight_lock = threading.Lock()
+        self.timeouts = 0 # requests lost without an answer
 
-        self.processing_timeout = time.time() + 60
-        self.retry_timer = None
+        metrics.collect("frames_skipped_total", lambda: self.motion.skipped, camera=self.name)
+        metrics.collect("ai_requests_timed_out_total", lambda: self.timeouts, camera=self.name)
+        metrics.collect("ai_requests_dropped_total", lambda: self.dropped_requests, camera=self.name)
+        metrics.collect("ai_in_flight", lambda: len(self.in_flight), camera=self.name)
+        metrics.collect("inference_rate", lambda: self.schedule.rate, camera=self.name)
 
+    @property
+    def processing_image(self):
+        return bool(self.in_flight)
+
+    @property
+    def healthy(self):
+        return self.pool.healthy
+
+    @property
+    def max_in_flight(self):
+        return self.pool.share()
+
+    def stop(self):
+        self.disable()
+        if self.owns_pool:
+            self.pool.stop()
 
     def check_connection(ai):
-        # Checks for timeouts
-        if time.time() > ai.processing_timeout and ai.active and ai.processing_image and not ai.local_image_queue.empty():
-            if ai.debug:
-                print("AI Timed out")
-            # Clear out the queues
-            
-            while not ai.image_queue.empty():
-                try:
-                    ai.image_queue.get(False)
-                except Exception as err:
-                    pass
-            while not ai.local_image_queue.empty():
-                ai.local_image_queue.get(False)
-            ai.processing_image = False
-            ai.disable()
-            ai.retry_timer = time.time() + 5
-        elif not ai.active and ai.retry_timer and time.time() > ai.retry_timer:
-            if ai.debug:
-                print("AI: Attempting to re-enable AI")
-            ai.enable()
+        ai.expire_requests()
+        if ai.active and ai.owns_pool:
+            ai.pool.check_connection()
+
+    def status(self):
+        return {
+            "active": self.active,
+            "healthy": self.healthy,
+            "detector": self.detector.name,
+            "in_flight": len(self.in_flight),
+            "queue_depth": self.queue_depth(),
+            "timeouts": self.timeouts,
+            "late": self.pool.late,
+            "dropped_requests": self.dropped_requests,
+            "dropped_results": self.pool.dropped_results.value,
+            "motion": {"sent": self.motion.sent, "skipped": self.motion.skipped, "camera_events": self.motion.camera_events},
+        }
+
+    def expire_requests(self):
+        # Drop requests whose answer never came back
+        now = time.time()
+        with self.in_flight_lock:
+            expired = [seq for seq, request in self.in_flight.items() if request.deadline < now]
+            for seq in expired:
+                # Its slot stays with the workers until one reads or skips it (see SharedFramePool);
+                # an answer that still comes back is discarded as late
+                self.in_flight.pop(seq)
+        self.timeouts += len(expired)
+        if expired and self.debug:
+            print(f"AI: Dropped {len(expired)} request(s) with no response: {expired}")
+
+    def encode(self, frame, roi=None):
+        # Encoded image(s) to send for a frame, and the regions they were cut from if it was cropped or tiled
+        if self.tiler.enabled:
+            regions = self.tiler.layout(frame.size, roi)
+            return self.tiler.encode(frame.cv2(), regions), regions
+        if roi:
+            regions = [roi_region(roi, frame.size)]
+            return self.tiler.encode(frame.cv2(), regions), regions
+        return [frame.resized_jpeg(self.input_size) if self.input_size else frame.jpeg()], None
+
+    def queue_frame(self, seq, frame):
+        with self.in_flight_lock:
+            request = self.in_flight.get(seq)
+        if request is None:
+            return
+        start = time.time()
+        images, regions = self.encode(frame, request.roi)
+        latency.record(self.name, "encode", time.time() - start)
+        deadline = request.deadline
+        data = b"".join(images) if len(images) > 1 else images[0]
+        # Hand the encoded frame to the workers through shared memory when a slot is free
+        ref = self.frame_pool.put(data)
+        with self.in_flight_lock:
+            request = self.in_flight.get(seq)
+            if request is None:
+                # Dropped while we were encoding
+                if ref:
+                    self.frame_pool.release(ref[0])
+                return
+            request.regions = regions
+            request.submitted = time.time()
+        self.pool.submit((seq, ref or data, [len(image) for image in images], deadline))
+
+    def queue_depth(self):
+        return self.pool.queue_depth()
+
+    def cancel(self, seq):
+        # Forget a request; a queued copy still owns its slot until a worker hands it back
+        with self.in_flight_lock:
+            self.in_flight.pop(seq, None)
 
     def toggle(self):
         if not self.active:
             self.enable()
         else:
-            self.disable()    
-        
+            self.disable()
+
     def enable(self):
         self.active = True
-        self.processing_timeout = time.time() + 30
-        self.retry_timer = None
         if self.debug:
-            print(f"AI: Enabled (processing_image: {self.processing_image})")
-    
+            print(f"AI: Enabled ({len(self.in_flight)} requests in flight)")
+
     def disable(self):
         self.active = False
-        self.retry_timer = None
+        with self.in_flight_lock:
+            self.in_flight.clear() # queued requests keep their slots until the workers read them; the answers are discarded as late
         if self.debug:
             print("AI: Disabled")
 
+    def camera_motion(ai, active):
+        # Motion events from the camera itself (see onvif_events.py). Called from the events thread
+        ai.motion.camera_event(active)
+        if active is not False:
+            ai.schedule.motion()
+            ai.scheduler.allocate()
+
     def get_detections(ai, cam):
         boxes = []
         timestamp = None
         image = None
         if not ai.active:
             return boxes, timestamp, image
-        if ai.processing_image:
-            if not ai.boxes.empty():
-                timestamp, boxes = ai.boxes.get(False)
-                if ai.debug:
-                    print("AI: Got a detection from darknet")
-                try:
-                    image = ai.local_image_queue.get(False)
-                    ai.processing_image = False
-                except queue.Empty:
-                    return ([], None, None)
-        else:
+
+        # Join the next result to the frame it was computed from
+        ai.pool.poll()
+        while ai.results:
+            seq, detections, timings = ai.results.popleft()
+            with ai.in_flight_lock:
+                request = ai.in_flight.pop(seq, None)
+            if request is None:
+                ai.pool.late += 1
+                continue
             if ai.debug:
-                print("AI: Requested image from camera to send to darknet")
-            ai.processing_image = True
-            ai.processing_timeout = time.time() + 30
-            cam.send_ai_snapshot(ai)
+                print(f"AI: Got a detection from {ai.detector.name} for request {seq}")
+            frame = request.frame
+            now = time.time()
+            inference = sum(timings)
+            latency.record(ai.name, "inference", inference)
+            latency.record(ai.name, "queue", max(0, now - (request.submitted or request.sent) - inference))
+            latency.record(ai.name, "detect", now - request.sent)
+            latency.record(ai.name, "result", now - frame.timestamp)
+            ai.schedule.completed(now - frame.timestamp, any(detections))
+            metrics.inc("ai_requests_completed_total", camera=ai.name)
+            if request.regions:
+                boxes = ai.tiler.merge(detections, request.regions, frame.size)
+                ai.tile_timings = list(zip(request.regions, timings))
+                if ai.debug:
+                    print("AI: Tile timings " + ", ".join(f"{region}: {1000*seconds:.0f}ms" for region, seconds in ai.tile_timings))
+            else:
+                boxes = detections[0]
+            for label, confidence, rect in boxes:
+                metrics.inc("detections_total", camera=ai.name, label=label)
+            ai.motion.notify_detections(boxes)
+            timestamp = datetime.fromtimestamp(frame.timestamp).strftime("%y%m%d%H%M%S%f")
+            image = frame
+            break
+
+        # Keep the pipeline full
+        # While recovering from a stall, one request at a time checks whether the restarted workers answer
+        ready = ai.healthy or (ai.pool.recovering and not ai.in_flight)
+        if ready and len(ai.in_flight) < ai.max_in_flight and ai.schedule.ready(ai.queue_depth()):
+            frame = cam.latest_frame()
+            roi = cam.roi(frame) if frame is not None else None
+            if frame is not None and cam.settling(frame):
+                ai.motion.reset() # the whole view is changing under the camera's own movement
+            send = frame is not None and ai.motion.should_send(frame, roi)
+            if send:
+                ai.schedule.sent()
+                metrics.inc("ai_requests_sent_total", camera=ai.name)
+                if ai.motion.moving:
+                    ai.schedule.motion()
+                seq = next(ai.pool.seqs)
+                with ai.in_flight_lock:
+                    ai.in_flight[seq] = Request(seq, frame, time.time() + ai.request_timeout, roi)
+                if ai.debug:
+                    print(f"AI: Sending request {seq} to {ai.detector.name}")
+                cam.send_ai_snapshot(ai, frame, seq)
         return boxes, timestamp, image
@@ -1,23 +1,20 @@
 #!/usr/bin/env python3
 import os
 import sys
-import datetime
 import random
-import subprocess
-import threading
 import itertools
 import time
-import PIL
-import json
-from gtts import gTTS
-
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
 
 import util
 from camera import Camera
 from ai import AI
-from hue import get_bridge, intruder_thread_start
+from pipeline import Pipeline
+from profiler import SamplingProfiler
+from status_server import StatusServer
+import latency
+import metrics
+
+pygame = None # imported by the UI, so --headless never loads it
 
 class UI:
     # UI Constants
@@ -28,11 +25,13 @@ class UI:
     YELLOW = (255, 255, 102)
     PINK = (245, 115, 158)
     RED = (255, 30, 30)
-    IGNORED_CLASSES = ("chair", "cake", "fire hydrant", "bird", "frisbee", "bowl", "spoon", "car", "clock", "parking meter", "cup", "bench", "umbrella", "vase")
 
-    def __init__(self, CONFIG, cam):
+    def __init__(self, CONFIG, cam, pipeline):
         self.debug = False
         # Initialize pygame settings
+        global pygame
+        os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+        import pygame
         pygame.init()
         pygame.font.init()
         self.font = pygame.font.SysFont('Consolas', 30)
@@ -54,29 +53,22 @@ class UI:
         self.ir_info = self.font.render(f'IR {UI.INFRARED_SYMBOLS[self.infrared_index]}', False, UI.WHITE)
         self.GOOD_BIRD = self.font.render(f'good bird', False, UI.PINK)#black)
         self.audio_info = self.font.render(f'Muted', False, UI.WHITE)
-        self.box_timer = time.time()
-        self.last_chirp = dict()
-        self.bird_boxes = []
+        self.pipeline = pipeline # detections, tracking, alerts and saving
         self.last_image = None
-        self.last_event = []
 
-        cam.set_name("birdcam")
-        cam.set_time()
-        
-        self.muted = False
-        self.audio_files = util.get_audio_files(CONFIG.get("audio_dir", "audio"))
         self.focus_gained = time.time() # Time that the window last gained focus
         self.is_focused = False
         self.spinner = itertools.cycle('◴'*3 + '◷'*3 + '◶'*3 + '◵'*3)
         self.K_LGUI = False
+        self.profiler = None # SamplingProfiler with --profile
 
-        self.config_path = CONFIG["config_path"]
-        self.config = CONFIG
-        self.write_bird_count(0)
+    @property
+    def muted(ui):
+        return ui.pipeline.alerts.muted
 
-        self.bridge = None
-        if "hue" in CONFIG:
-            self.bridge = get_bridge(CONFIG["hue"]["address"], CONFIG["hue"]["user"])
+    @muted.setter
+    def muted(ui, muted):
+        ui.pipeline.alerts.muted = muted
  
     def update_size(ui):
         ui.display_size = pygame.display.get_surface().get_size()
@@ -86,7 +78,7 @@ class UI:
         for event in pygame.event.get():
             if event.type == pygame.QUIT: # x in titlebar
                 # Tell the client to shut down
-                halt(ai, cam)
+                halt(ai, cam, ui)
             elif event.type == pygame.WINDOWFOCUSGAINED:
                 ui.focus_gained = time.time()
                 ui.is_focused = True
@@ -96,7 +88,7 @@ class UI:
                 if event.key == pygame.K_LGUI:
                     ui.K_LGUI = True
                 elif event.key == pygame.K_q:
-                    halt(ai, cam)
+                    halt(ai, cam, ui)
                 elif event.key in range(pygame.K_1, pygame.K_9 + 1) and not ui.K_LGUI and ui.is_focused and time.time() - 0.1 > ui.focus_gained:
                     if cam.speed_modifier != 0.01:
                         cam.ctrl_preset(event.key - pygame.K_0)
@@ -115,7 +107,10 @@ class UI:
                     ai.toggle()
                 elif event.key == pygame.K_d:
                     ui.debug = not ui.debug
+                    ui.pipeline.debug = ui.debug
                     ai.debug = not ai.debug
+                    ai.pool.debug = ai.debug
+                    ai.motion.debug = ai.debug
                     cam.debug = not cam.debug
                     print("Debug mode set to ", ui.debug)
                 elif event.key == pygame.K_r:
@@ -152,6 +147,8 @@ class UI:
                     pass
                 elif event.key == pygame.K_m:
                     ui.muted = not ui.muted
+                elif event.key == pygame.K_t:
+                    ui.pipeline.autotrack.toggle()
                 else:
                     for k in ui.keys:
                         if ui.keys[k] == event.key:
@@ -181,6 +178,13 @@ class UI:
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 pos = event.pos
                 ui.click_point = pos
+                if ui.pipeline.autotrack.enabled:
+                    ui.pipeline.autotrack.choose(ui.frame_point(pos, cam))
+
+    def frame_point(ui, pos, cam):
+        # Normalized frame coordinates of a point on the display, through the digital zoom crop in display_feed
+        zoom = cam.digital_zoom
+        return tuple(zoom / 2 + p / size * (1 - zoom) for p, size in zip(pos, ui.display_size))
 
     def draw_overlay(ui):
         # Display control information
@@ -203,7 +207,7 @@ class UI:
 
             if ui.click_point:
                 pygame.draw.circle(ui.display, (255,0,0), ui.click_point, 3, 3)
-            for box in ui.bird_boxes:
+            for box in ui.pipeline.tracker.boxes(time.time()):
                 label, confidence, rect = box
                 x,y,w,h = rect
                 scale = (ui.display_size[0], ui.display_size[1])
@@ -213,23 +217,19 @@ class UI:
                     ui.display.blit(ui.GOOD_BIRD, (rect[0], rect[1]))
                 else:
                     pass
-            
-            if ui.bird_boxes and time.time() > ui.box_timer:
-                ui.bird_boxes = []
-            #    ui.write_bird_count(0)
+
 
         # Update the screen
         pygame.display.flip()#update()
         ui.display.fill(UI.BLACK)
 
     def display_feed(ui, cam):
-        cam.restore_rtsp()
-
         image = cam.view("pygame")
 
         #ui.focus_info = ui.font.render(f'{cam.focus_amount(image):.2f}', False, UI.WHITE)
 
         if image is not None:
+            metrics.inc("frames_displayed_total", camera=cam.name)
             image = pygame.transform.scale(image, ui.display_size)
             ui.last_image = image
             if cam.digital_zoom != 0:
@@ -249,185 +249,89 @@ class UI:
             errored_out = ui.large_font.render(f"No feed detected", False,  UI.RED)
             ui.display.blit(errored_out, (10, 200))
     
-    def process_boxes(ui, boxes, timestamp, image):
-        if not boxes:
-            return
-        labels_present = dict()
-        ui.bird_boxes = boxes
-        ui.box_timer = time.time() + 3
-
-        # Extract detections of high confidence
-        for b in boxes:
-            label, confidence, rect = b
-            if confidence > 0.9: 
-                if label not in ui.IGNORED_CLASSES and not ui.muted:
-                    ui.speak(label.replace("person", "intruder"))
-                if ui.bridge and label in ["person", "bear", "car", "truck"]:
-                    print("INTRUDER! Activating floodlight")
-                    intruder_thread_start(ui.bridge, ui.config["hue"]["light_names"])
-            x1,y1,x2,y2 = rect
-            if confidence > 0.8:
-                labels_present[label] = labels_present.get(label, 0) + 1 
-
-        # Check for labels of interest
-        labels_of_interest = sorted([label for label in labels_present if label in ui.config.get("auto_screenshot_labels", tuple())])
-        screenshot = False
-        for label in labels_present:
-            if not ui.muted and label in ui.audio_files and (label not in ui.IGNORED_CLASSES or label in ui.config.get("auto_screenshot_labels", [])):
-                # play the relevant alert sound
-                ui.chirp(ui.audio_files[label])
-
-        if labels_of_interest:
-            print(f"DETECTED: {boxes}")
-            current_timestamp = datetime.datetime.strptime(timestamp, "%y%m%d%H%M%S%f")
-
-            # Split up path, to make it easier to search through & host as an image server
-            yy = timestamp[:2]
-            mm = timestamp[2:4]
-            dd = timestamp[4:6]
-            if ui.last_event and (current_timestamp-ui.last_event[-1]) < datetime.timedelta(seconds=7):
-                # Add this on to the last event, if not much time has passed
-                ui.last_event.append(current_timestamp)
-                
-            else:
-                # Start a new event
-                ui.last_event = [current_timestamp,]
-            label_list="_".join(labels_of_interest)
-            directory = os.path.join(ui.config.get("output_dir", "images"), yy, mm, dd, f"{ui.last_event[0].strftime('%H%M%S')}_{label_list}")
-            os.makedirs(directory, exist_ok=True)
-
-            fpath = os.path.join(directory, timestamp + ".jpg")
-
-            try:
-                with open(fpath, "wb") as f:
-                    f.write(image)
-                if len(ui.last_event) == 1:
-                    # Save thumbnail
-                    with open(os.path.join(directory, ".thumb.jpg"), "wb") as f:
-                        f.write(image)
-
-                util.save_xml(boxes, fpath)
-            except Exception as err:
-                print("Could not save {image} - out of disk space?", err)
-            if "elastic" in ui.config:
-                ui.save_observation(labels_present, timestamp, fpath)
-        
-        
-        #if "bird" in labels_present:
-        #    with open("sightings.txt", "a") as f:
-        #        f.write(f"{timestamp}\t{labels_present['bird']}\n")
-        #    ui.write_bird_count(labels_present['bird'])
-
-
-    def chirp(self, chirp_type="bird.wav"):
-        if chirp_type[:4]=="bear" and datetime.datetime.now().hour > 5 and datetime.datetime.now().hour < 22:
-            return # It's probably not a true bear if it's in the day
-        if time.time() > self.last_chirp.get(chirp_type, time.time() - 1):
-            subprocess.Popen(['ffplay', os.path.join(self.config.get("audio_dir", "audio"), chirp_type), '-nodisp', '-autoexit'],
-                             stdout=subprocess.PIPE, 
-                             stderr=subprocess.PIPE)
-        self.last_chirp[chirp_type] = time.time() + 360
-
-    def speak(self, text):  
-        myobj = gTTS(text=text, lang="en", slow=False)
-          
-        obj_path = os.path.join(self.config.get("audio_dir", "audio"), "voice.mp3")
-        myobj.save(obj_path)
-        os.system(f"(ffplay {obj_path} -autoexit -nodisp -af 'volume=0.1' > /dev/null 2>&1)&")
-
     def run(ui, ai, cam):
         ui.update_size()
 
         # Get detections from the AI
-        boxes, timestamp, image = ai.get_detections(cam)
-        ui.process_boxes(boxes, timestamp, image)
+        ui.pipeline.step()
 
         # Process UI inputs
         ui.handle_input(ai, cam) 
         cam.ptz()
 
         # Display the latest image
+        start = time.time()
         ui.display_feed(cam)
 
         # Display overlay/status
-        color = UI.PINK if time.time() > ai.processing_timeout and ai.active and ai.processing_image else UI.WHITE if ai.processing_image and ai.active else UI.WHITE if ai.active else UI.YELLOW
-        symbol = "◙" if time.time() > ai.processing_timeout and ai.active and ai.processing_image else next(ui.spinner) if ai.processing_image and ai.active else "●" if ai.active else "○"
+        color = UI.PINK if ai.active and not ai.healthy else UI.WHITE if ai.active else UI.YELLOW
+        symbol = "◙" if ai.active and not ai.healthy else next(ui.spinner) if ai.processing_image and ai.active else "●" if ai.active else "○"
         ui.ai_info = ui.font.render(f'AI {symbol}', False,  color)
         ui.draw_overlay()
+        latency.record(ai.name, "display", time.time() - start)
 
         # Ensure the connections are still alive
-        cam.check_connection()
-        ai.check_connection()
-    
-    def save_observation(self, labels_present, timestamp, image_path):
-        threading.Thread(target=self.save_observation_thread, args=[labels_present, timestamp, image_path]).start()
-
-    def save_observation_thread(self, labels_present, timestamp, image_path):
-        if "elastic" in self.config:
-            elastic = self.config["elastic"]
-            index = "detections.images"
-            document = { "@timestamp" : util.timestamp(timestamp), "detections": labels_present, "src_ip": self.config["address"], "file_path": image_path, "type": "image", "model": "darknet.pytorch.yolov7" } 
-            uri = f"https://{elastic['address']}:{elastic.get('port', 9200)}/{index}/_doc/"
-            command = f"""curl --cacert {elastic['ca_cert']} -u {elastic['user']}:{elastic['password']} {uri} -H 'Content-Type: application/json' -XPOST -d '{json.dumps(document)}'"""
-            result = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.read().decode("utf8")
-            if "success" in result:
-                print("Successfully recorded observation")
-            else:
-                print("Failed to record observation:", result)
-   
-    def elastic_bird_count(self, count):
-        if "elastic" in self.config:
-            elastic = self.config["elastic"]
-            doc_name = self.config_path.replace("config", "bird_count").replace(".", "_")
-            uri = f"https://{elastic['address']}:{elastic.get('port', 9200)}/birds/_doc/{doc_name}"
-            command = f"""curl --cacert {elastic['ca_cert']} -u {elastic['user']}:{elastic['password']} {uri} -H 'Content-Type: application/json' -XPOST -d """ + "'{ \"count\" : " + f"{count}" +  ' }\''
-            result = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.read().decode("utf8")
-            if "updated" in result:
-                print("Successfully updated bird count to", count)
-            else:
-                print("Failed to update bird count:", result, command)
- 
-    def write_bird_count(self, count):
-        if "elastic" in self.config:
-            self.elastic_bird_count(count)
+        ui.pipeline.check_connection()
 
 def main():
+    # --headless runs capture, detection, tracking, saving and alerts as a service with no window;
+    # viewer.py can attach to it through the status server.
+    # --profile samples the main loop and every thread, writing collapsed stacks (see profiler.py)
+    flags = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    headless = "--headless" in flags
+    profile = "--profile" in flags
+
     # Load configuration settings    
     CONFIG = None
-    if len(sys.argv) > 1:
-        CONFIG = util.load_config(sys.argv[1])
+    if len(args) > 0:
+        CONFIG = util.load_config(args[0])
     else:
         CONFIG = util.load_config(".config")
+
+    if headless:
+        from supervisor import serve
+        serve([CONFIG], profile)
+        return
     
     cam = Camera(CONFIG)
-    ui = UI(CONFIG, cam) 
-    ai = AI(CONFIG)   
+    ai = AI(CONFIG)
+    ui = UI(CONFIG, cam, Pipeline(CONFIG, cam, ai))
+    ui.profiler = SamplingProfiler(CONFIG) if profile else None
+    if ui.profiler:
+        ui.profiler.start()
+
+    if "status_port" in CONFIG:
+        status = StatusServer(CONFIG["status_port"], CONFIG.get("status_address", "127.0.0.1"))
+        status.add("/status", ai.scheduler.status)
+        status.add("/ai", ai.status)
+        status.add("/latency", latency.histograms.summary)
+        status.add("/metrics", metrics.registry.render)
+        status.start()
+    latency.histograms.window = CONFIG.get("latency_window", 60)
+    latency.histograms.start_logging(CONFIG.get("latency_log_interval", 0))
  
     # Main UI Loop
     while True:
         try:
             ui.run(ai, cam)
         except KeyboardInterrupt as e:
-            halt(ai, cam)
+            halt(ai, cam, ui)
             break
 
-def halt(ai, cam):
-    ai.image_queue.put(None) # send the halt command
+def halt(ai, cam, ui=None):
+    if ui and ui.profiler:
+        ui.profiler.stop() # write out the last samples
+    if ui:
+        ui.pipeline.stop()
+    ai.stop() # halt the detector workers
+    cam.stop_capture()
     if cam.rtsp:
         cam.rtsp.close() # Close the rtsp client
-    time.sleep(0.1)
-    if ai.image_process:
-        ai.image_process.terminate()
-        ai.image_process.join()
-
-    # Empty out the queues
-    while not ai.image_queue.empty():
-        ai.image_queue.get()
-    while not ai.local_image_queue.empty():
-        ai.local_image_queue.get()
 
     # Shut down pygame
-    pygame.quit()
+    if pygame:
+        pygame.quit()
     
     # Exit the main program
     exit()
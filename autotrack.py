@@ -0,0 +1,164 @@
+import time
+
+import latency
+import metrics
+
+class AutoTracker:
+    """
+    Closed-loop PTZ: keeps one track (the bird clicked on, or else the one followed longest)
+    centered by driving the camera's continuous pan/tilt, and zooms, optically if the camera
+    can or digitally otherwise, until it fills target_size of the frame.
+    Detections arrive one inference late, so the target is predicted forward from its frame
+    timestamps to when a command would take effect. Speeds are rounded and commands rate
+    limited, so the camera only hears about real changes.
+    """
+    def __init__(self, config, cam, tracker):
+        autotrack = config.get("autotrack", dict())
+        self.enabled = autotrack.get("enabled", False)
+        self.labels = autotrack.get("labels", ["bird"])
+        self.deadband = autotrack.get("deadband", 0.08) # offset from center (fraction of the frame) left alone
+        self.gain = autotrack.get("gain", 0.4) # speed per unit of offset, in ptz units (0.5 is full speed)
+        self.max_speed = autotrack.get("max_speed", 0.2)
+        self.speed_step = autotrack.get("speed_step", 0.02) # speeds are rounded to this, so jitter doesn't resend
+        self.interval = autotrack.get("interval", 0.3) # minimum seconds between commands (stops go out at once)
+        self.lead = autotrack.get("lead", None) # seconds from command to movement, measured if None
+        self.target_size = autotrack.get("target_size", 0.25) # fraction of the frame the target should fill, 0 for no zoom
+        self.zoom_tolerance = autotrack.get("zoom_tolerance", 0.3) # relative size error left alone
+        self.zoom_speed = autotrack.get("zoom_speed", 0.3)
+        self.lost_after = autotrack.get("lost_after", 2) # seconds without a detection before giving up on a target
+        self.manual_hold = autotrack.get("manual_hold", 5) # seconds to stay out of the way after manual control
+        self.return_preset = autotrack.get("return_preset", None) # preset to go back to once nothing is left to follow
+        self.return_after = autotrack.get("return_after", 10) # seconds after losing the target
+        self.cam = cam
+        self.tracker = tracker
+        self.name = cam.name
+        self.target = None # id of the track being followed
+        self.chosen = False # whether the target was picked by the user
+        self.command = (0, 0, 0) # (pan, tilt, zoom) last sent
+        self.last_command = 0
+        self.last_manual = 0
+        self.lost_time = None
+        metrics.collect("autotrack_following", lambda: int(self.enabled and self.target is not None), camera=self.name)
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        if not self.enabled:
+            self.release()
+        print(f"Autotrack: {'Enabled' if self.enabled else 'Disabled'}")
+
+    def choose(self, point):
+        # Follow the track nearest to a point (normalized x, y), e.g. where the user clicked
+        tracks = list(self.tracker.tracks.values())
+        if not tracks:
+            return None
+        track = min(tracks, key=lambda track: (track.rect[0] - point[0])**2 + (track.rect[1] - point[1])**2)
+        self.target, self.chosen = track.id, True
+        print(f"Autotrack: Following track {track.id} ({track.label})")
+        return track
+
+    def update(self, now=None):
+        if not self.enabled:
+            return
+        now = now or time.time()
+        cam = self.cam
+        if cam.horizontal or cam.vertical or cam.zooming:
+            self.last_manual = now # the user is steering
+            self.command = (0, 0, 0)
+        if now - self.last_manual < self.manual_hold:
+            return
+
+        track = self.select(now)
+        if track is None:
+            self.lost(now)
+            return
+        self.lost_time = None
+
+        # The box is where the bird was when its frame was captured; aim for where it will be
+        # once the command reaches the camera
+        x, y, w, h = track.predict(now + self.lead_time())
+        if not (cam.cgi or cam.onvif):
+            # A fixed camera can only zoom digitally on the middle of the frame (and its RTSP feed must stay on),
+            # so it zooms no further than keeps the bird in view
+            margin = max(abs(x - 0.5) + w / 2, abs(y - 0.5) + h / 2)
+            self.zoom(max(w, h), centered=True, limit=1 - 2 * margin)
+            return
+        pan = self.speed(x - 0.5, self.command[0])
+        tilt = self.speed(0.5 - y, self.command[1])
+        zoom = self.zoom(max(w, h), centered=not (pan or tilt))
+        self.send((pan, tilt, zoom), now)
+        if any(self.command):
+            cam.shift_rtsp() # low latency snapshots while moving
+
+    def select(self, now):
+        track = self.tracker.tracks.get(self.target)
+        if track is not None and now - track.last_seen <= self.lost_after:
+            return track
+        candidates = [track for track in self.tracker.tracks.values() if track.label in self.labels and now - track.last_seen <= self.lost_after]
+        track = max(candidates, key=lambda track: (track.hits, track.max_confidence), default=None)
+        if track is not None:
+            self.target, self.chosen = track.id, False
+            print(f"Autotrack: Following track {track.id} ({track.label})")
+        return track
+
+    def lead_time(self):
+        if self.lead is not None:
+            return self.lead
+        # Measured control round trip (see cgi_control.py/onvif_control.py), plus half the command interval
+        return latency.histograms.median(self.name, "command", 0.2) + self.interval / 2
+
+    def speed(self, error, current):
+        # Proportional speed for an offset from center, with hysteresis so it doesn't chatter at the edge of the deadband
+        if abs(error) < (self.deadband / 2 if current else self.deadband):
+            return 0
+        speed = max(-self.max_speed, min(self.max_speed, self.gain * error))
+        return round(round(speed / self.speed_step) * self.speed_step, 3)
+
+    def zoom(self, size, centered, limit=0.9):
+        # Zoom speed (optical), or adjusts the digital zoom and returns 0
+        if not self.target_size:
+            return 0
+        cam = self.cam
+        if not (cam.optical_zoom_enabled and (cam.cgi or cam.onvif)):
+            if centered:
+                # The digital zoom crops the middle 1 - digital_zoom of the frame
+                wanted = max(0, min(0.9, limit, 1 - size / self.target_size))
+                cam.digital_zoom += 0.2 * (wanted - cam.digital_zoom)
+            return 0
+        if not centered:
+            return 0 # get it in the middle first
+        ratio = size / self.target_size
+        if ratio < 1 - self.zoom_tolerance:
+            return self.zoom_speed
+        if ratio > 1 + self.zoom_tolerance:
+            return -self.zoom_speed
+        return 0
+
+    def send(self, command, now):
+        if command == self.command:
+            return
+        if any(command) and now - self.last_command < self.interval:
+            return
+        self.cam.move(*command)
+        self.command = command
+        self.last_command = now
+        metrics.inc("autotrack_moves_total", camera=self.name)
+
+    def lost(self, now):
+        if self.target is not None:
+            print(f"Autotrack: Lost track {self.target}")
+            self.target = None
+            self.lost_time = now
+            self.cam.digital_zoom = 0
+        if any(self.command):
+            self.send((0, 0, 0), now)
+        if self.return_preset is not None and (self.cam.cgi or self.cam.onvif) and self.lost_time and now - self.lost_time > self.return_after:
+            self.cam.ctrl_preset(self.return_preset)
+            self.lost_time = None
+
+    def release(self):
+        # Stop anything the tracker started
+        if any(self.command):
+            self.cam.move(0, 0, 0)
+        self.command = (0, 0, 0)
+        self.target = None
+        self.cam.digital_zoom = 0
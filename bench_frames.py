@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark comparing per-frame image conversions:
+util.convert_image (every consumer converts from scratch) vs the shared, lazily cached Frame views.
+
+Usage: python bench_frames.py [image.jpg] [frames] [renders_per_frame]
+"""
+import io
+import os
+import sys
+import time
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import numpy as np
+from PIL import Image
+
+import util
+from frame import Frame
+
+def synthetic_image(size=(2560, 1440)):
+    pixels = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+def consumers(view, renders_per_frame):
+    # What a displayed frame goes through: the UI renders it (possibly several times
+    # if the render loop outpaces capture), the AI sends it as JPEG, and focus/restore_rtsp read it as cv2
+    for _ in range(renders_per_frame):
+        view("pygame")
+    view("jpeg")
+    view("cv2")
+    view("cv2")
+
+def bench_convert_image(payload, frames, renders_per_frame):
+    conversions = 0
+    convert_image = util.convert_image
+    def counted(image, output_format):
+        nonlocal conversions
+        result = convert_image(image, output_format)
+        if result is not image:
+            conversions += 1
+        return result
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        consumers(lambda output_format: counted(payload, output_format), renders_per_frame)
+    return time.perf_counter() - start, conversions
+
+def bench_frame(payload, frames, renders_per_frame):
+    conversions = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        frame = Frame(payload)
+        consumers(frame.view, renders_per_frame)
+        conversions += frame.conversions
+    return time.perf_counter() - start, conversions
+
+def main():
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        image = Image.open(sys.argv[1]).convert("RGB")
+    else:
+        image = synthetic_image()
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    renders_per_frame = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    buf = io.BytesIO()
+    image.save(buf, format="jpeg")
+    payloads = {"PIL (rtsp)": image, "JPEG (cgi)": buf.getvalue()}
+
+    print(f"{frames} frames of {image.size[0]}x{image.size[1]}, rendered {renders_per_frame}x each")
+    for name, payload in payloads.items():
+        old_time, old_ops = bench_convert_image(payload, frames, renders_per_frame)
+        new_time, new_ops = bench_frame(payload, frames, renders_per_frame)
+        print(f"{name:>11}: convert_image {old_ops/frames:.1f} conversions/frame {1000*old_time/frames:.1f} ms/frame | "
+              f"Frame {new_ops/frames:.1f} decodes+encodes/frame {1000*new_time/frames:.1f} ms/frame")
+
+if __name__ == "__main__":
+    main()
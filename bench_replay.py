@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+End-to-end replay benchmark: recorded frames go through Camera (capture thread and ring buffer),
+AI (motion gate, scheduler, encode, shared memory, detector workers) and Pipeline (tracking, saving),
+with the stub detector standing in for darknet. Reports throughput, per-stage latency, CPU and RSS.
+
+Usage: python bench_replay.py [frames directory or video file] [seconds] [overrides.config]
+Without a source, synthetic 2560x1440 frames are used. The overrides file is a config dict merged
+over the benchmark defaults, e.g. {"detector": {"type": "stub", "latency": 0.2}, "tiling": {"enabled": True}}.
+The last line printed is a JSON record; append it to a file to compare runs across commits.
+"""
+import ast
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import cv2
+import numpy as np
+from PIL import Image
+
+import latency
+import metrics
+from ai import AI
+from camera import Camera
+from pipeline import Alerts, Pipeline, Storage
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class ReplayFeed:
+    """Stands in for rtsp.Client, handing out recorded frames in order (and looping)"""
+    def __init__(self, source=None, synthetic_frames=20):
+        self.video = None
+        self.images = []
+        self.index = 0
+        self.last = None
+        if source and os.path.isdir(source):
+            # Held in memory so disk reads don't count against the pipeline
+            for name in sorted(os.listdir(source)):
+                path = os.path.join(source, name)
+                if name.lower().endswith((".jpg", ".jpeg")):
+                    with open(path, "rb") as f:
+                        self.images.append(f.read()) # JPEG bytes, like a CGI snapshot
+                elif name.lower().endswith(IMAGE_EXTENSIONS):
+                    self.images.append(cv2.imread(path))
+            if not self.images:
+                raise ValueError(f"No images found in {source}")
+        elif source:
+            self.video = cv2.VideoCapture(source)
+            if not self.video.isOpened():
+                raise ValueError(f"Could not open video {source}")
+        else:
+            rng = np.random.default_rng(0)
+            for _ in range(synthetic_frames):
+                buf = io.BytesIO()
+                Image.fromarray(rng.integers(0, 255, (1440, 2560, 3), dtype=np.uint8)).save(buf, format="jpeg")
+                self.images.append(buf.getvalue())
+
+    def isOpened(self):
+        return True
+
+    def read(self, raw=False):
+        # Like the client, raw returns the last frame handed out rather than advancing
+        if raw:
+            return self.last
+        if self.video is not None:
+            ok, image = self.video.read()
+            if not ok:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self.video.read()
+            self.last = image if ok else None
+            return self.last
+        self.last = self.images[self.index % len(self.images)]
+        self.index += 1
+        return self.last
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+def bench_config(output_dir, overrides):
+    config = {
+        "config_path": "bench",
+        "name": "replay",
+        "capture_fps": 25,
+        "detector": {"type": "stub", "latency": 0.05, "workers": 2},
+        "scheduler": {"budget": 100, "active_rate": 25, "motion_rate": 25, "idle_rate": 25, "latency_target": 5},
+        "motion": {"enabled": False},
+        "auto_screenshot_labels": ["bird"],
+        "track_save_interval": 1,
+        "output_dir": output_dir,
+        "audio_dir": output_dir,
+    }
+    config.update(overrides)
+    return config
+
+def rss_mb():
+    # Current resident set size of this process
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def counter(samples, name, camera):
+    return sum(value for labels, value in samples.get(name, dict()).items() if ("camera", camera) in labels)
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    overrides = dict()
+    if len(sys.argv) > 3:
+        with open(sys.argv[3]) as f:
+            overrides = ast.literal_eval(f.read())
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        config = bench_config(output_dir, overrides)
+        feed = ReplayFeed(source)
+        cam = Camera(config)
+        cam.rtsp = feed
+        ai = AI(config)
+        alerts = Alerts(config)
+        alerts.muted = True
+        pipeline = Pipeline(config, cam, ai, alerts, Storage())
+        loop_interval = config.get("supervisor_interval", 0.02)
+        latency.histograms.window = seconds + 60
+
+        start_cpu = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        while time.time() - start < seconds:
+            loop_start = time.time()
+            pipeline.step()
+            pipeline.check_connection()
+            time.sleep(max(0, loop_interval - (time.time() - loop_start)))
+        elapsed = time.time() - start
+        rss = rss_mb()
+
+        cam.stop_capture()
+        ai.stop()
+        end_cpu = resource.getrusage(resource.RUSAGE_SELF)
+        workers_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    samples = metrics.registry.samples()
+    name = ai.name
+    result = {
+        "commit": commit(),
+        "source": source or "synthetic",
+        "seconds": round(elapsed, 1),
+        "detector": config["detector"],
+        "capture_fps": round(counter(samples, "frames_captured_total", name) / elapsed, 2),
+        "inference_fps": round(counter(samples, "ai_requests_completed_total", name) / elapsed, 2),
+        "sent": counter(samples, "ai_requests_sent_total", name),
+        "completed": counter(samples, "ai_requests_completed_total", name),
+        "timed_out": counter(samples, "ai_requests_timed_out_total", name),
+        "dropped": counter(samples, "ai_requests_dropped_total", name),
+        "saved": counter(samples, "images_saved_total", name),
+        "cpu_percent": round(100 * (end_cpu.ru_utime + end_cpu.ru_stime - start_cpu.ru_utime - start_cpu.ru_stime) / elapsed, 1),
+        "workers_cpu_percent": round(100 * (workers_cpu.ru_utime + workers_cpu.ru_stime) / elapsed, 1),
+        "rss_mb": round(rss, 1),
+        "workers_max_rss_mb": round(workers_cpu.ru_maxrss / 1024, 1),
+        "latency_ms": latency.histograms.summary().get(name, dict()),
+    }
+
+    print(f"{result['seconds']}s of {result['source']}: capture {result['capture_fps']} fps, inference {result['inference_fps']} fps "
+          f"({result['completed']}/{result['sent']} completed, {result['timed_out']} timed out, {result['dropped']} dropped, {result['saved']} saved)")
+    print(f"CPU {result['cpu_percent']}% main + {result['workers_cpu_percent']}% workers, RSS {result['rss_mb']} MB main, {result['workers_max_rss_mb']} MB largest worker")
+    for stage, stats in result["latency_ms"].items():
+        print(f"{stage:>10}: p50 {stats['p50']:7.1f}ms  p95 {stats['p95']:7.1f}ms  p99 {stats['p99']:7.1f}ms  ({stats['count']} samples)")
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
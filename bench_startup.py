@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: how long until a (re)started camera is useful again.
+Measures, each in a fresh interpreter, the import time of application.py and supervisor.py and
+the slowest modules behind them, then the time to build Camera, AI and Pipeline for one camera
+and to get its first frame and first detection result.
+
+Usage: python bench_startup.py [camera.config] [runs]
+Without a config the camera replays synthetic frames into the stub detector (see bench_replay.py);
+with one, it connects to the configured camera (e.g. one from camera_simulator.py), so CGI, ONVIF
+and RTSP setup are included. The last line printed is a JSON record for comparing commits.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def run(code, importtime=False):
+    # Runs code in a fresh interpreter and returns its stdout and stderr
+    flags = ["-X", "importtime"] if importtime else []
+    result = subprocess.run([sys.executable, *flags, "-c", code], capture_output=True, text=True, cwd=HERE)
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(errors[-1] if errors else "failed")
+    return result.stdout, result.stderr
+
+def import_time(module, runs):
+    times = []
+    for _ in range(runs):
+        stdout, importtime = run(f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)", importtime=True)
+        times.append(float(stdout.strip().splitlines()[-1]))
+    return statistics.median(times), slowest_imports(importtime)
+
+def slowest_imports(importtime, count=8):
+    # Modules imported directly by the benchmarked module, by cumulative import time (python -X importtime)
+    packages = dict()
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit() or len(name) - len(name.lstrip()) != 3:
+            continue # nesting is shown by indenting two spaces per level
+        packages[name.strip()] = int(cumulative) / 1e6
+    return dict(sorted(packages.items(), key=lambda item: -item[1])[:count])
+
+CAMERA_STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+stages = dict()
+def mark(stage):
+    stages[stage] = round(time.perf_counter() - start, 3)
+import util
+from ai import AI
+from camera import Camera
+from pipeline import Alerts, Pipeline, Storage
+import metrics
+mark("imports")
+path = {path!r}
+if path:
+    config = util.load_config(path)
+else:
+    import tempfile
+    from bench_replay import ReplayFeed, bench_config
+    config = bench_config(tempfile.mkdtemp(), dict())
+    feed = ReplayFeed(synthetic_frames=2)
+    mark("frames")
+cam = Camera(config)
+if not path:
+    cam.rtsp = feed
+mark("camera")
+ai = AI(config)
+mark("ai")
+alerts = Alerts(config)
+alerts.muted = True
+pipeline = Pipeline(config, cam, ai, alerts, Storage())
+mark("pipeline")
+while time.perf_counter() - start < 60:
+    if "first_frame" not in stages and cam.latest_frame() is not None:
+        mark("first_frame")
+    pipeline.step()
+    if metrics.registry.values.get("ai_requests_completed_total"):
+        mark("first_result")
+        break
+    time.sleep(0.005)
+cam.stop_capture()
+ai.stop()
+print(json.dumps(stages))
+"""
+
+def camera_startup(path, runs):
+    results = []
+    for _ in range(runs):
+        stdout, _ = run(CAMERA_STARTUP.format(path=path))
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+    stages = dict.fromkeys(stage for result in results for stage in result) # in the order they happened
+    return {stage: round(statistics.median(result[stage] for result in results if stage in result), 3) for stage in stages}
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    from bench_replay import commit
+
+    result = {"commit": commit(), "config": path or "replay", "runs": runs}
+    for module in ("application", "supervisor"):
+        seconds, slowest = import_time(module, runs)
+        result[f"import_{module}"] = round(seconds, 3)
+        print(f"import {module}: {1000*seconds:.0f}ms, slowest: " + ", ".join(f"{name} {1000*seconds:.0f}ms" for name, seconds in slowest.items()))
+    result["startup"] = camera_startup(path, runs)
+    print("camera startup: " + ", ".join(f"{stage} {1000*seconds:.0f}ms" for stage, seconds in result["startup"].items()))
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
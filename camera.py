@@ -1,27 +1,29 @@
-import rtsp
 import time
 from datetime import datetime
 import threading
-import pygame
-
 import cv2
 import math
 
-from onvif_control import ONVIFControl
-from cgi_control import CGIControl
-from util import convert_image
+from util import camera_name, convert_image
+from frame import Frame
+from frame_buffer import FrameBuffer
+import latency
+import metrics
 
 class Camera:
     def __init__(self, CONFIG):
         self.debug = False
-        # Initialize CGI controls
+        self.name = camera_name(CONFIG)
+        # Initialize CGI controls. Optional subsystems are only imported when configured
         self.cgi = None
         if "cgi" in CONFIG:
+           from cgi_control import CGIControl
            self.cgi = CGIControl(CONFIG)
 
         # Initialize ONVIF controls
         self.onvif = None
         if "onvif" in CONFIG:
+            from onvif_control import ONVIFControl
             self.onvif = ONVIFControl(CONFIG)
 
         # Initialize RTSP
@@ -33,8 +35,11 @@ class Camera:
             self.connect_rtsp()
         
         # Camera feed
-        self.buffer = []
-        self.last_snapshot_queued = time.time() - 100
+        self.buffer = FrameBuffer(CONFIG.get("buffer_size", 8))
+        self.capture_interval = 1 / CONFIG.get("capture_fps", 25)
+        self.capture_retry = 0.1 # seconds to wait after a failed read
+        self.capturing = False
+        self.capture_thread = None
  
         # Camera movement
         self.last_pan = self.last_tilt = 0
@@ -42,6 +47,14 @@ class Camera:
         self.preset = (0, 0)
         self.last_preset = (0, 0)
 
+        # Regions of interest, as normalized (x, y, w, h) per preset number
+        self.rois = {str(key): tuple(roi) for key, roi in CONFIG.get("roi", dict()).items()}
+        self.roi_settle = CONFIG.get("roi_settle", 3) # seconds for the camera to reach a preset
+        self.active_preset = None # preset the camera is currently framing, if any
+        self.preset_time = 0
+        self.moved = 0 # last time the camera was told to move, stop or go to a preset
+        self.moving = False # whether a continuous move is running (see move)
+
         self.horizontal = self.vertical = 0
         self.pan = self.tilt = 0
         self.speed_modifier = 0.1
@@ -56,46 +69,25 @@ class Camera:
     
         self.speed_threshold = 0.001
 
+        self.start_capture()
+
     def flush_mode(self, purge_mode):
-        i = 0
-        while i < len(self.buffer):
-            mode = self.buffer[i][1]
-            if mode == purge_mode:
-                self.buffer.pop(i)
-            else:
-                i = i + 1
+        self.buffer.flush_mode(purge_mode)
 
-    def view(self, output_format=None):
-        self.buffer.sort(key = lambda x: x[0])
-        while len(self.buffer) > 5 and self.buffer[0][0] + 0.1 < time.time():
-            # image is stale
-            self.buffer.pop(0)
-            print("Too fast!")
-        if not self.buffer:
-            img = self.get_snapshot(returns=True)
-            if img is None:
-                return None
-            if output_format:
-                img = convert_image(img, output_format)
-            return img
-        if len(self.buffer) < 3 and self.last_snapshot_queued + 0.03 < time.time():
-            self.queue_thread_snapshot()
- 
-        if len(self.buffer) > 1:
-            timestamp, mode, img = self.buffer.pop(0)
-        else:
-            timestamp, mode, img = self.buffer[0]
+    def latest_frame(self):
+        return self.buffer.latest()
 
+    def view(self, output_format=None):
+        frame = self.buffer.latest()
+        if frame is None:
+            return None
         if output_format:
-            img = convert_image(img, output_format)
-        return img
+            return frame.view(output_format)
+        return frame.payload
 
-    def get_snapshot(self, high_quality=False, mode=None, returns=False, buffer=True, start_time=None):
-        start_time = start_time or time.time()
-        self.last_snapshot_queued = start_time
+    def read_feed(self, high_quality=False, mode=None):
+        # Take the snapshot from the appropriate feed. Returns (mode, snapshot)
         snapshot = None
-        
-        # Take the snapshot from the appropriate feed
         if self.rtsp and (mode == "rtsp" or not (self.realtime and self.cgi)):
             snapshot = self.rtsp.read()
             mode = "rtsp"
@@ -105,52 +97,79 @@ class Camera:
                 mode = "cgi"
             except Exception as err:
                 print("Error getting snapshot", err)
-        if snapshot is None:
-            return None 
-       
-        # Place it in the buffer or return it directly
-        if buffer and self.buffer:
-            self.buffer.append((start_time, mode, convert_image(snapshot, "pygame")))
-        if returns:
-            return snapshot #convert_image(snapshot, "pygame")
+        return mode, snapshot
+
+    def get_snapshot(self, high_quality=False, mode=None):
+        mode, snapshot = self.read_feed(high_quality, mode)
+        return snapshot
+
+    def start_capture(self):
+        if self.capture_thread and self.capture_thread.is_alive():
+            return
+        self.capturing = True
+        self.capture_thread = threading.Thread(target=self.capture_worker, name=f"capture {self.name}", daemon=True)
+        self.capture_thread.start()
+
+    def stop_capture(self):
+        self.capturing = False
+        if self.capture_thread:
+            self.capture_thread.join(timeout=1)
+            self.capture_thread = None
+
+    def capture_worker(self):
+        # Single long-lived worker that keeps the ring buffer filled with the newest frames
+        last_decoded = None
+        while self.capturing:
+            start_time = time.time()
+            mode, snapshot = self.read_feed()
+            latency.record(self.name, "read", time.time() - start_time)
+            if snapshot is None:
+                time.sleep(self.capture_retry)
+                continue
+            # rtsp.Client.read() wraps its latest decoded array in a new image on every call, but keeps the
+            # array itself until the next frame is decoded, so repeats are spotted by the array (read after
+            # the image: at worst a frame is skipped, never buffered twice)
+            decoded = self.rtsp.read(raw=True) if mode == "rtsp" else None
+            if decoded is None or decoded is not last_decoded:
+                self.buffer.put(Frame(snapshot, start_time, mode))
+                metrics.inc("frames_captured_total", camera=self.name)
+                last_decoded = decoded
+            delay = self.capture_interval - (time.time() - start_time)
+            if delay > 0:
+                time.sleep(delay)
     
-    def send_ai_snapshot(cam, ai):
-        threading.Thread(target=cam.send_ai_snapshot_thread, args=[ai,]).start()
+    def send_ai_snapshot(cam, ai, frame, seq):
+        threading.Thread(target=cam.send_ai_snapshot_thread, args=[ai, frame, seq], name=f"ai send {cam.name}").start()
    
-    def send_ai_snapshot_thread(cam, ai):
-        image = cam.view("jpeg")
-        if image is not None and ai.image_queue != None and ai.local_image_queue != None:
-            ai.local_image_queue.put(image)
-            ai.image_queue.put(image)
+    def send_ai_snapshot_thread(cam, ai, frame, seq):
+        try:
+            ai.queue_frame(seq, frame)
             if ai.debug:
-                print("Cam: successfully queued image for AI")
-        else: 
-            ai.processing_image = False
-            if ai.debug:
-                print("Cam: failed to queue image for AI")
+                print(f"Cam: successfully queued image {seq} for AI")
+        except Exception as err:
+            ai.cancel(seq)
+            print(f"Cam: failed to queue image {seq} for AI", err)
  
-    def queue_thread_snapshot(cam, high_quality=False):
-        start_time = time.time()
-        self.last_snapshot_queued = start_time
-        threading.Thread(target=cam.get_snapshot, args=[high_quality, None, False, True, start_time]).start()
-
     def save_hqsnapshot(cam, filename):
-        content = cam.get_snapshot(high_quality=True, returns=True, buffer=False)
-        content = convert(content, "jpeg")
+        content = cam.get_snapshot(high_quality=True)
+        if content is None:
+            return
+        content = Frame(content).jpeg()
         with open(filename, "wb") as f:
             f.write(content)
 
-    def save_rtsp_snapshot(cam, filename):
-        #pygame.time.wait(500) # wait for the video feed to catch up
-        snapshot = cam.rtsp.read()
-        if snapshot is not None:
-            snapshot.save(filename)
+    def save_rtsp_snapshot(cam, filename, start_time):
+        # Save the first frame captured after the snapshot was requested
+        frame = cam.buffer.wait_for(start_time)
+        if frame is not None:
+            with open(filename, "wb") as f:
+                f.write(frame.jpeg())
 
     def take_snapshot(cam):
         filename = "snapshots/" + datetime.now().strftime("%y%m%d%H%M%S.jpg")
 
         if cam.rtsp:
-            threading.Thread(target=cam.save_rtsp_snapshot, args=[filename]).start()
+            threading.Thread(target=cam.save_rtsp_snapshot, args=[filename, time.time()]).start()
         else:
             threading.Thread(target=cam.save_hqsnapshot, args=[filename,]).start()
     
@@ -183,6 +202,7 @@ class Camera:
         self.connect_rtsp()
 
     def connect_rtsp(self):
+        import rtsp
         self.rtsp = rtsp.Client(rtsp_server_uri = self.rtsp_server_uri)
         if self.rtsp.isOpened():
             print(f"Connected to RTSP client")
@@ -195,13 +215,11 @@ class Camera:
 
     def rtsp_equals_snapshot(self):
         # compare whether the current rtsp image roughly matches the snapshot
-        current_rtsp = self.get_snapshot(mode="rtsp", returns=True, buffer=False)
-        current_snapshot = self.get_snapshot(mode="snapshot", returns=True, buffer=False)
+        current_rtsp = self.get_snapshot(mode="rtsp")
+        current_snapshot = self.get_snapshot(mode="snapshot")
         if current_rtsp is None or current_snapshot is None:
             return False
-        current_rtsp = convert_image(current_rtsp, "cv2")
-        current_snapshot = convert_image(current_snapshot, "cv2")
-        hist = self.hist(current_rtsp, current_snapshot)
+        hist = self.hist(Frame(current_rtsp).cv2(), Frame(current_snapshot).cv2())
         return (hist < 0.18) 
 
     def hist(self, img1, img2):        
@@ -222,11 +240,11 @@ class Camera:
         return cv2.compareHist(hist1, hist2, 3)
 
     def focus_amount(self, img=None):
-        img = img if img is not None else self.view()
+        img = img if img is not None else self.latest_frame()
         if img is None:
             return 0
 
-        img = convert_image(img, "cv2")
+        img = img.cv2() if isinstance(img, Frame) else convert_image(img, "cv2")
         # Crop it
         h, w, _ = img.shape
         img = img[w*2//5:w*3//5, h*2//5:h*3//5]
@@ -250,7 +268,7 @@ class Camera:
                 if cam.cgi:
                     cam.cgi.pan(cam.pan)
                 elif cam.onvif:
-                    cam.onvif.continuous_move(cam.pan, 0, 0)
+                    cam.onvif.move(cam.pan, 0, 0)
             else:
                 if cam.alternate_timer <= time.time():
                     cam.alternate = not cam.alternate
@@ -258,22 +276,24 @@ class Camera:
                 if cam.cgi:
                     cam.cgi.tilt(cam.tilt)
                 elif cam.onvif:
-                    cam.onvif.continuous_move(0, cam.tilt, 0)
+                    cam.onvif.move(0, cam.tilt, 0)
         # Pan
         elif abs(cam.pan) > cam.speed_threshold:
             if cam.cgi:
                 cam.cgi.pan(cam.pan)
             elif cam.onvif:
-                cam.onvif.continuous_move(cam.pan, cam.tilt, cam.zooming)
+                cam.onvif.move(cam.pan, cam.tilt, cam.zooming)
         # Tilt
         elif abs(cam.tilt) > cam.speed_threshold:
             if cam.cgi:
                 cam.cgi.tilt(cam.tilt)
             elif cam.onvif:
-                cam.onvif.continuous_move(cam.pan, cam.tilt, cam.zooming)
+                cam.onvif.move(cam.pan, cam.tilt, cam.zooming)
         # Zoom
         if cam.zooming or abs(cam.pan) > cam.speed_threshold or abs(cam.tilt) > cam.speed_threshold:
             cam.shift_rtsp()
+            cam.active_preset = None # no longer framing a preset
+            cam.moved = time.time()
         if cam.digital_zoom_rate != 0:
             cam.digital_zoom += cam.digital_zoom_rate / 2
             cam.digital_zoom = max(0, min(cam.digital_zoom, 0.95))
@@ -283,12 +303,34 @@ class Camera:
         cam.last_preset = cam.preset
         cam.last_speed = cam.speed_modifier
 
+    def move(cam, pan, tilt, zoom=0):
+        # Continuous pan/tilt/zoom at these speeds (as in ptz) until the next move, e.g. from the auto tracker
+        if not (pan or tilt or zoom):
+            cam.control_stop()
+            return
+        if cam.cgi:
+            # One axis per command
+            if abs(pan) >= abs(tilt) and pan:
+                cam.cgi.pan(pan)
+            elif tilt:
+                cam.cgi.tilt(tilt)
+            else:
+                cam.cgi.send_command('zoomin' if zoom > 0 else 'zoomout', 50)
+        elif cam.onvif:
+            cam.onvif.move(pan, tilt, zoom)
+        cam.shift_rtsp()
+        cam.active_preset = None
+        cam.moved = time.time()
+        cam.moving = True
+
     def control_stop(self):
         if self.cgi:
             self.cgi.send_command('stop') 
         elif self.onvif:
-            self.onvif.continuous_move(0, 0, 0)
+            self.onvif.move(0, 0, 0)
         self.digital_zoom_rate = 0
+        self.moved = time.time() # it takes a moment to come to a stop
+        self.moving = False
    
     def set_name(cam, name="birdcam"): 
         if cam.cgi:
@@ -298,17 +340,31 @@ class Camera:
         if cam.cgi:
             cam.cgi.set_time()
 
+    def settling(cam, frame):
+        # Whether the frame was captured while the camera was moving, or before it had settled afterwards
+        return cam.moving or frame.timestamp < cam.moved + cam.roi_settle
+
+    def roi(cam, frame):
+        # Region of interest for the active preset, once the camera has settled there
+        if cam.active_preset is None or frame.timestamp < cam.preset_time + cam.roi_settle:
+            return None
+        return cam.rois.get(str(cam.active_preset))
+
     def ctrl_preset(cam, key):
+        cam.active_preset = key
+        cam.preset_time = cam.moved = time.time()
         if cam.cgi:
             cam.cgi.ctrl_preset(key)
         elif cam.onvif:
-            cam.onvif.go_to_preset(key)
+            cam.onvif.queue_command(cam.onvif.go_to_preset, key)
 
     def set_preset(cam, key):
+        cam.active_preset = key
+        cam.preset_time = time.time()
         if cam.cgi:
             cam.cgi.set_preset(key)
         elif cam.onvif:
-            cam.onvif.set_preset(key)
+            cam.onvif.queue_command(cam.onvif.set_preset, key)
     
     def zoom(cam, amount):
         amount = amount * cam.speed_modifier
@@ -318,7 +374,7 @@ class Camera:
             elif amount < 0:
                 cam.cgi.send_command('zoomout', 50)
         elif cam.optical_zoom_enabled and cam.onvif:
-            cam.onvif.continuous_move(0, 0, amount)
+            cam.onvif.move(0, 0, amount)
         else: # digital zoom
             cam.digital_zoom_rate = amount
                     
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Simulates hi3510 PTZ cameras on localhost for development and load testing without hardware.
+Each simulated camera serves the CGI endpoints birdcam uses (ptzctrl.cgi, preset.cgi, param.cgi,
+/tmpfs/auto.jpg, /tmpfs/snap.jpg, the /sd/ recording listings) and an MJPEG stream that the rtsp
+client (OpenCV) can open in place of the RTSP feed. Requests can be slowed, jittered and failed.
+It also stands in for the camera's ONVIF services (device, media, PTZ and PullPoint events), with
+motion events every motion_period seconds, or on demand with /sim/motion?state=true or false.
+
+Usage: python camera_simulator.py [simulator.config]
+       python camera_simulator.py [cameras] [frames directory or video file]
+The config is a dict like the camera configs, e.g.
+{"cameras": 20, "port": 8100, "source": "recordings/", "fps": 10, "latency": 0.05, "jitter": 0.05,
+ "failure_rate": 0.01, "failure_mode": "error", "motion_period": 30, "motion_duration": 5, "config_dir": "simulated"}
+A camera config is written to config_dir for each simulated camera, so the whole set can be
+run with python supervisor.py simulated/*.config
+"""
+import ast
+import base64
+import json
+import os
+import pprint
+import random
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+NAMESPACES = {
+    "s": "http://www.w3.org/2003/05/soap-envelope",
+    "tt": "http://www.onvif.org/ver10/schema",
+    "tds": "http://www.onvif.org/ver10/device/wsdl",
+    "trt": "http://www.onvif.org/ver10/media/wsdl",
+    "tptz": "http://www.onvif.org/ver20/ptz/wsdl",
+    "tev": "http://www.onvif.org/ver10/events/wsdl",
+    "wsnt": "http://docs.oasis-open.org/wsn/b-2",
+    "wsa5": "http://www.w3.org/2005/08/addressing",
+    "tns1": "http://www.onvif.org/ver10/topics",
+}
+MOTION_TOPIC = "tns1:RuleEngine/CellMotionDetector/Motion"
+
+class FrameSource:
+    """Pre-encoded frames shared by every simulated camera, played back in real time"""
+    def __init__(self, source=None, fps=10, size=(2560, 1440), sub_size=(640, 360), max_frames=250):
+        self.fps = fps
+        self.path = source
+        self.full = []
+        self.sub = []
+        for image in self.images(source, size, max_frames):
+            self.full.append(cv2.imencode(".jpg", image)[1].tobytes())
+            self.sub.append(cv2.imencode(".jpg", cv2.resize(image, sub_size, interpolation=cv2.INTER_AREA))[1].tobytes())
+        self.start = time.time()
+
+    def images(self, source, size, max_frames):
+        if source and os.path.isdir(source):
+            for name in sorted(os.listdir(source))[:max_frames]:
+                image = cv2.imread(os.path.join(source, name))
+                if image is not None:
+                    yield image
+        elif source:
+            video = cv2.VideoCapture(source)
+            for _ in range(max_frames):
+                ok, image = video.read()
+                if not ok:
+                    break
+                yield image
+            video.release()
+        else:
+            # A moving gradient, so consecutive frames differ
+            x = np.linspace(0, 255, size[0], dtype=np.float32)
+            for i in range(20):
+                row = ((x + i * 12) % 256).astype(np.uint8)
+                yield cv2.merge([np.tile(row, (size[1], 1))] * 3)
+
+    def frame(self, high_quality=True):
+        frames = self.full if high_quality else self.sub
+        return frames[int((time.time() - self.start) * self.fps) % len(frames)]
+
+class SimulatedCamera:
+    """One simulated camera: HTTP server, PTZ/preset/infrared state and failure injection"""
+    def __init__(self, name, port, frames, config):
+        self.name = name
+        self.port = port
+        self.frames = frames
+        self.user = config.get("user", "admin")
+        self.password = config.get("password", "admin")
+        self.latency = config.get("latency", 0.0) # seconds added to every response
+        self.jitter = config.get("jitter", 0.0) # up to this many random seconds on top
+        self.failure_rate = config.get("failure_rate", 0.0) # fraction of requests that fail
+        self.failure_mode = config.get("failure_mode", "error") # "error" (HTTP 500), "drop" (close the connection) or "hang"
+        self.hang_time = config.get("hang_time", 30)
+        self.lock = threading.Lock()
+        self.state = {"action": "stop", "speed": 0, "preset": None, "presets": [], "infrared": "auto", "name": "", "time": None}
+        self.requests = dict() # endpoint -> count
+        self.failures = 0
+        self.commands = [] # last PTZ/preset commands, newest last
+
+        # ONVIF events
+        self.onvif = config.get("onvif", True)
+        self.motion_period = config.get("motion_period", 30) # seconds between simulated motion events, 0 for none
+        self.motion_duration = config.get("motion_duration", 5) # seconds each one lasts
+        self.motion = False
+        self.onvif_presets = dict() # token -> name
+        self.subscriptions = dict() # id -> {"messages": [...], "expires": time}
+        self.subscription_ids = 0
+        self.events = threading.Condition()
+
+        camera = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the real camera
+            def do_GET(self):
+                camera.handle(self)
+            def do_POST(self):
+                camera.handle_soap(self)
+            def log_message(self, format, *args):
+                pass
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"simulator {name}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        if self.onvif and self.motion_period:
+            threading.Thread(target=self.motion_worker, name=f"simulator motion {self.name}", daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def config(self):
+        # Camera config pointing birdcam at this simulated camera
+        address = f"127.0.0.1:{self.port}"
+        config = {"name": self.name, "address": address, "user": self.user, "password": self.password,
+                "cgi": {"path": f"http://{address}/web/cgi-bin/hi3510/"}, "rtsp": f"http://{self.user}:{self.password}@{address}/stream.mjpg"}
+        if self.onvif:
+            config["onvif"] = {"address": "127.0.0.1", "port": self.port, "events": True}
+        return config
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        path = url.path.replace("/web/cgi-bin/", "/cgi-bin/")
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        if path == "/sim/state":
+            return self.respond(request, json.dumps(self.status(), indent=2).encode("utf8"), "application/json")
+        args = parse_args(url.query)
+        if path == "/sim/motion":
+            self.set_motion(args.get("state", "true") == "true")
+            return self.respond(request, b"ok\r\n")
+        if not self.authorized(request):
+            request.send_response(401)
+            request.send_header("WWW-Authenticate", 'Basic realm="hi3510"')
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+        if self.inject(request):
+            return
+
+        if path == "/cgi-bin/hi3510/ptzctrl.cgi":
+            self.command(action=args.get("-act", "stop"), speed=int(args.get("-speed", 0) or 0))
+            return self.respond(request, b"[Succeed]set ok.\r\n")
+        if path == "/cgi-bin/hi3510/preset.cgi":
+            number = args.get("-number")
+            if args.get("-act") == "set":
+                self.command(presets=sorted(set(self.state["presets"]) | {number}))
+            self.command(preset=number, action="preset")
+            return self.respond(request, b"[Succeed]set ok.\r\n")
+        if path == "/cgi-bin/hi3510/param.cgi":
+            return self.respond(request, self.param(args).encode("utf8"))
+        if path in ("/tmpfs/auto.jpg", "/tmpfs/snap.jpg"):
+            return self.respond(request, self.frames.frame(high_quality=path.endswith("snap.jpg")), "image/jpeg")
+        if path == "/stream.mjpg":
+            return self.stream(request)
+        if path.startswith("/sd/"):
+            return self.sd(request, path)
+        request.send_error(404)
+
+    def inject(self, request):
+        # Added latency and failures. Returns whether the request failed
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.jitter * random.random())
+        if random.random() < self.failure_rate:
+            with self.lock:
+                self.failures += 1
+            self.fail(request)
+            return True
+        return False
+
+    def authorized(self, request):
+        expected = "Basic " + base64.b64encode(f"{self.user}:{self.password}".encode("utf8")).decode("ascii")
+        return request.headers.get("Authorization") == expected
+
+    def command(self, **changes):
+        with self.lock:
+            self.state.update(changes)
+            self.commands = (self.commands + [dict(changes, time=time.time())])[-50:]
+
+    def param(self, args):
+        commands = args.get("cmd", [])
+        commands = commands if isinstance(commands, list) else [commands]
+        lines = []
+        for cmd in commands:
+            if cmd == "getinfrared":
+                lines.append(f'var infraredstat="{self.state["infrared"]}";')
+            elif cmd == "setinfrared":
+                self.command(infrared=args.get("-infraredstat", "auto"))
+            elif cmd == "setoverlayattr":
+                self.command(name=args.get("-name", ""))
+            elif cmd == "setservertime":
+                self.command(time=args.get("-time"))
+            elif cmd == "sysreboot":
+                self.command(action="reboot")
+            elif cmd.startswith("get"):
+                lines.append(f'var {cmd[3:]}="1";')
+        return "\r\n".join(lines) + "\r\n" if lines else "[Succeed]set ok.\r\n"
+
+    def sd(self, request, path):
+        # Directory listings of simulated recordings, in the camera's format (see downloader.py)
+        today = datetime.now()
+        dates = [(today - timedelta(days=days)).strftime("%Y%m%d") for days in range(2, -1, -1)]
+        parts = [part for part in path.split("/") if part]
+        if len(parts) == 1:
+            links = [f"/sd/{date}/" for date in dates]
+        elif len(parts) == 3 and parts[2] == "record000":
+            date = parts[1][2:]
+            links = [f"/sd/{parts[1]}/record000/P{date}_{hour:02d}0000_{hour:02d}5959.265" for hour in range(24)]
+        elif path.endswith(".265") and self.frames.path and os.path.isfile(self.frames.path):
+            with open(self.frames.path, "rb") as f:
+                return self.respond(request, f.read(), "application/octet-stream")
+        else:
+            return request.send_error(404)
+        body = "<html><body>" + "".join(f'<a href="{link}">{link}</a><br>' for link in links) + "</body></html>"
+        self.respond(request, body.encode("utf8"), "text/html")
+
+    def stream(self, request):
+        # MJPEG over HTTP, which OpenCV (and so the rtsp client) can open like an RTSP feed
+        request.close_connection = True
+        request.send_response(200)
+        request.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        request.end_headers()
+        try:
+            while True:
+                frame = self.frames.frame()
+                request.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(frame)).encode() + b"\r\n\r\n" + frame + b"\r\n")
+                time.sleep(1 / self.frames.fps)
+                if random.random() < self.failure_rate:
+                    with self.lock:
+                        self.failures += 1
+                    return # the stream drops out
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def fail(self, request):
+        if self.failure_mode == "drop":
+            request.close_connection = True
+            return
+        if self.failure_mode == "hang":
+            time.sleep(self.hang_time)
+            request.close_connection = True
+            return
+        request.send_error(500)
+
+    def respond(self, request, body, content_type="text/plain"):
+        request.send_response(200)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def status(self):
+        with self.lock:
+            status = {"name": self.name, "state": dict(self.state), "requests": dict(self.requests), "failures": self.failures, "commands": list(self.commands)}
+        with self.events:
+            status.update(motion=self.motion, subscriptions=len(self.subscriptions))
+        return status
+
+    # ONVIF (SOAP 1.2). WS-Security headers are accepted without checking them.
+    def handle_soap(self, request):
+        path = urlparse(request.path).path
+        body = request.rfile.read(int(request.headers.get("Content-Length", 0)))
+        try:
+            operation = ET.fromstring(body).find("s:Body", NAMESPACES)[0]
+        except (ET.ParseError, TypeError, IndexError):
+            return request.send_error(400)
+        name = operation.tag.split("}")[-1]
+        with self.lock:
+            self.requests[f"{path} {name}"] = self.requests.get(f"{path} {name}", 0) + 1
+        handler = getattr(self, f"onvif_{name}", None)
+        if not self.onvif or handler is None:
+            return self.respond_soap(request, fault(f"{name} is not supported"), 500)
+        if self.inject(request):
+            return
+        response = handler(operation, path)
+        if response is None:
+            return self.respond_soap(request, fault("Unknown subscription"), 500)
+        self.respond_soap(request, response)
+
+    def respond_soap(self, request, body, status=200):
+        declarations = " ".join(f'xmlns:{prefix}="{namespace}"' for prefix, namespace in NAMESPACES.items())
+        envelope = f'<?xml version="1.0" encoding="UTF-8"?>\n<s:Envelope {declarations}><s:Body>{body}</s:Body></s:Envelope>'.encode("utf8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/soap+xml; charset=utf-8")
+        request.send_header("Content-Length", str(len(envelope)))
+        request.end_headers()
+        request.wfile.write(envelope)
+
+    def onvif_GetCapabilities(self, operation, path):
+        address = f"http://127.0.0.1:{self.port}/onvif"
+        return (f"<tds:GetCapabilitiesResponse><tds:Capabilities>"
+                f"<tt:Device><tt:XAddr>{address}/device_service</tt:XAddr></tt:Device>"
+                f"<tt:Events><tt:XAddr>{address}/events</tt:XAddr><tt:WSSubscriptionPolicySupport>false</tt:WSSubscriptionPolicySupport>"
+                f"<tt:WSPullPointSupport>true</tt:WSPullPointSupport><tt:WSPausableSubscriptionManagerInterfaceSupport>false</tt:WSPausableSubscriptionManagerInterfaceSupport></tt:Events>"
+                f"<tt:Media><tt:XAddr>{address}/media</tt:XAddr><tt:StreamingCapabilities><tt:RTPMulticast>false</tt:RTPMulticast>"
+                f"<tt:RTP_TCP>true</tt:RTP_TCP><tt:RTP_RTSP_TCP>true</tt:RTP_RTSP_TCP></tt:StreamingCapabilities></tt:Media>"
+                f"<tt:PTZ><tt:XAddr>{address}/ptz</tt:XAddr></tt:PTZ>"
+                f"</tds:Capabilities></tds:GetCapabilitiesResponse>")
+
+    def onvif_GetProfiles(self, operation, path):
+        return '<trt:GetProfilesResponse><trt:Profiles token="Profile_1" fixed="true"><tt:Name>mainStream</tt:Name></trt:Profiles></trt:GetProfilesResponse>'
+
+    def onvif_ContinuousMove(self, operation, path):
+        pan_tilt = operation.find(".//tt:PanTilt", NAMESPACES)
+        zoom = operation.find(".//tt:Zoom", NAMESPACES)
+        self.command(action="move", pan=float(pan_tilt.get("x", 0)) if pan_tilt is not None else 0,
+                     tilt=float(pan_tilt.get("y", 0)) if pan_tilt is not None else 0, zoom=float(zoom.get("x", 0)) if zoom is not None else 0)
+        return "<tptz:ContinuousMoveResponse/>"
+
+    def onvif_Stop(self, operation, path):
+        self.command(action="stop", pan=0, tilt=0, zoom=0)
+        return "<tptz:StopResponse/>"
+
+    def onvif_GetPresets(self, operation, path):
+        with self.lock:
+            presets = dict(self.onvif_presets)
+        return "<tptz:GetPresetsResponse>" + "".join(f'<tptz:Preset token="{token}"><tt:Name>{name}</tt:Name></tptz:Preset>' for token, name in presets.items()) + "</tptz:GetPresetsResponse>"
+
+    def onvif_SetPreset(self, operation, path):
+        name = operation.findtext("tptz:PresetName", "", NAMESPACES)
+        with self.lock:
+            token = str(max(map(int, self.onvif_presets), default=0) + 1)
+            self.onvif_presets[token] = name
+        self.command(presets=sorted(set(self.state["presets"]) | {name}))
+        return f"<tptz:SetPresetResponse><tptz:PresetToken>{token}</tptz:PresetToken></tptz:SetPresetResponse>"
+
+    def onvif_RemovePreset(self, operation, path):
+        with self.lock:
+            self.onvif_presets.pop(operation.findtext("tptz:PresetToken", "", NAMESPACES), None)
+        return "<tptz:RemovePresetResponse/>"
+
+    def onvif_GotoPreset(self, operation, path):
+        with self.lock:
+            name = self.onvif_presets.get(operation.findtext("tptz:PresetToken", "", NAMESPACES))
+        self.command(preset=name, action="preset")
+        return "<tptz:GotoPresetResponse/>"
+
+    def onvif_CreatePullPointSubscription(self, operation, path):
+        termination = parse_duration(operation.findtext("tev:InitialTerminationTime", "", NAMESPACES), 60)
+        with self.events:
+            now = time.time()
+            self.subscriptions = {key: value for key, value in self.subscriptions.items() if value["expires"] > now}
+            self.subscription_ids += 1
+            # Like a real camera, a new subscription starts with the current state
+            self.subscriptions[self.subscription_ids] = {"messages": [notification(self.motion, "Initialized")], "expires": now + termination}
+            address = f"http://127.0.0.1:{self.port}/onvif/subscription/{self.subscription_ids}"
+        return (f"<tev:CreatePullPointSubscriptionResponse><tev:SubscriptionReference><wsa5:Address>{address}</wsa5:Address></tev:SubscriptionReference>"
+                f"<wsnt:CurrentTime>{utc(now)}</wsnt:CurrentTime><wsnt:TerminationTime>{utc(now + termination)}</wsnt:TerminationTime></tev:CreatePullPointSubscriptionResponse>")
+
+    def subscription(self, path):
+        try:
+            return self.subscriptions.get(int(path.rsplit("/", 1)[-1]))
+        except ValueError:
+            return None
+
+    def onvif_PullMessages(self, operation, path):
+        timeout = min(parse_duration(operation.findtext("tev:Timeout", "", NAMESPACES), 10), 60)
+        limit = int(operation.findtext("tev:MessageLimit", "100", NAMESPACES))
+        with self.events:
+            subscription = self.subscription(path)
+            if subscription is None or subscription["expires"] < time.time():
+                return None
+            self.events.wait_for(lambda: subscription["messages"], timeout)
+            messages, subscription["messages"] = subscription["messages"][:limit], subscription["messages"][limit:]
+            expires = subscription["expires"]
+        return (f"<tev:PullMessagesResponse><tev:CurrentTime>{utc(time.time())}</tev:CurrentTime><tev:TerminationTime>{utc(expires)}</tev:TerminationTime>"
+                + "".join(messages) + "</tev:PullMessagesResponse>")
+
+    def onvif_Renew(self, operation, path):
+        termination = parse_duration(operation.findtext("wsnt:TerminationTime", "", NAMESPACES), 60)
+        with self.events:
+            subscription = self.subscription(path)
+            if subscription is None:
+                return None
+            subscription["expires"] = time.time() + termination
+        return f"<wsnt:RenewResponse><wsnt:TerminationTime>{utc(time.time() + termination)}</wsnt:TerminationTime><wsnt:CurrentTime>{utc(time.time())}</wsnt:CurrentTime></wsnt:RenewResponse>"
+
+    def onvif_Unsubscribe(self, operation, path):
+        with self.events:
+            subscription = self.subscription(path)
+            if subscription is None:
+                return None
+            self.subscriptions = {key: value for key, value in self.subscriptions.items() if value is not subscription}
+        return "<wsnt:UnsubscribeResponse/>"
+
+    def set_motion(self, active):
+        with self.events:
+            self.motion = active
+            for subscription in self.subscriptions.values():
+                subscription["messages"].append(notification(active))
+            self.events.notify_all()
+
+    def motion_worker(self):
+        # Motion now and then, like a camera watching a feeder
+        while True:
+            time.sleep(max(0, self.motion_period - self.motion_duration) * random.uniform(0.5, 1.5))
+            self.set_motion(True)
+            time.sleep(self.motion_duration)
+            self.set_motion(False)
+
+def notification(active, operation="Changed"):
+    # A cell motion event in the format most cameras use
+    return (f'<wsnt:NotificationMessage><wsnt:Topic Dialect="http://www.onvif.org/ver10/tev/topicExpression/ConcreteSet">{MOTION_TOPIC}</wsnt:Topic>'
+            f'<wsnt:Message><tt:Message UtcTime="{utc(time.time())}" PropertyOperation="{operation}"><tt:Source>'
+            f'<tt:SimpleItem Name="VideoSourceConfigurationToken" Value="VideoSource_1"/><tt:SimpleItem Name="Rule" Value="MotionDetectorRule"/></tt:Source>'
+            f'<tt:Data><tt:SimpleItem Name="IsMotion" Value="{str(active).lower()}"/></tt:Data></tt:Message></wsnt:Message></wsnt:NotificationMessage>')
+
+def fault(reason):
+    return (f'<s:Fault><s:Code><s:Value>s:Receiver</s:Value></s:Code>'
+            f'<s:Reason><s:Text xml:lang="en">{reason}</s:Text></s:Reason></s:Fault>')
+
+def utc(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def parse_duration(text, default):
+    # Seconds in an xs:duration like PT10S or PT1M30S
+    parts = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", (text or "").strip())
+    if not parts or not any(parts.groups()):
+        return default
+    hours, minutes, seconds = (float(part or 0) for part in parts.groups())
+    return 3600 * hours + 60 * minutes + seconds
+
+def parse_args(query):
+    # hi3510 arguments look like -act=left&-speed=30&cmd=a&cmd=b; repeated keys become lists
+    args = dict()
+    for part in query.split("&"):
+        if not part:
+            continue
+        key, _, value = part.partition("=")
+        if key in args:
+            args[key] = (args[key] if isinstance(args[key], list) else [args[key]]) + [value]
+        else:
+            args[key] = value
+    return args
+
+def main():
+    config = dict()
+    if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+        with open(sys.argv[1]) as f:
+            config = ast.literal_eval(f.read())
+    else:
+        if len(sys.argv) > 1:
+            config["cameras"] = int(sys.argv[1])
+        if len(sys.argv) > 2:
+            config["source"] = sys.argv[2]
+
+    frames = FrameSource(config.get("source"), config.get("fps", 10))
+    config_dir = config.get("config_dir", "simulated")
+    os.makedirs(config_dir, exist_ok=True)
+    port = config.get("port", 8100)
+    cameras = []
+    for i in range(config.get("cameras", 1)):
+        camera = SimulatedCamera(f"sim{i}", port + i, frames, config)
+        camera.start()
+        cameras.append(camera)
+        camera_config = dict(camera.config(), output_dir=os.path.join(config_dir, "images"))
+        with open(os.path.join(config_dir, f"{camera.name}.config"), "w") as f:
+            f.write(pprint.pformat(camera_config, sort_dicts=False)) # a Python literal, like util.load_config reads
+    print(f"Simulating {len(cameras)} camera(s) on ports {port}-{port + len(cameras) - 1}, configs in {config_dir}/")
+
+    try:
+        while True:
+            time.sleep(10)
+            requests = sum(sum(camera.requests.values()) for camera in cameras)
+            failures = sum(camera.failures for camera in cameras)
+            print(f"Simulator: {requests} requests, {failures} injected failures")
+    except KeyboardInterrupt:
+        for camera in cameras:
+            camera.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,43 @@
+import collections
+import threading
+import time
 import requests
 from urllib.parse import quote
 from datetime import datetime
 
+from util import camera_name
+import latency
+import metrics
+
 class CGIControl:
     INFRARED = "open", "close", "auto"
+    AXES = {"left": "pan", "right": "pan", "up": "tilt", "down": "tilt", "zoomin": "zoom", "zoomout": "zoom", "focusin": "focus", "focusout": "focus"}
     # COMMANDS = ('left', 'right', 'up', 'down', 'home', 'stop', 'zoomin', 'zoomout', 'focusin', 'focusout', 'hscan', 'vscan')
     def __init__(self, config):
         self.address = config["address"]
         self.auth = config["user"], config["password"]
         self.speed_range = config.get("cgi", dict()).get("speed_range", (1, 63))
+        self.timeout = config.get("cgi", dict()).get("timeout", 5) # seconds
+        self.name = camera_name(config)
+        # Keep-alive connections, so each command doesn't pay for TCP setup and auth.
+        # Snapshots and queries come from the capture/UI threads, commands from the worker
+        self.session = self.new_session()
+        self.command_session = self.new_session()
+
+        # Commands are sent in order on a background thread, so the UI never waits on the camera
+        self.commands = collections.deque()
+        self.pending = threading.Condition()
+        self.moving = None # (name, speed) of the last movement the camera was sent
+        self.thread = threading.Thread(target=self.command_worker, name=f"cgi {self.name}", daemon=True)
+        self.thread.start()
+
+    def new_session(self):
+        session = requests.Session()
+        session.auth = self.auth
+        return session
+
+    def get(self, request):
+        return self.session.get(request, timeout=self.timeout)
 
     def pan(self, amount):
         self.send_command('left' if amount < 0 else 'right', round(abs(amount) * 2 * (self.speed_range[1]-self.speed_range[0]) + self.speed_range[0]))
@@ -17,24 +46,59 @@ class CGIControl:
         self.send_command('down' if amount < 0 else 'up', round(abs(amount) * 2 * (self.speed_range[1]-self.speed_range[0]) + self.speed_range[0]))
 
     def send_command(self, name, speed=1):
-        print("Sending command", name)
         if speed > self.speed_range[1] - 1:
             speed = 0 # speed 0 goes faster than max speed
 
         request = f"http://{self.address}/cgi-bin/hi3510/ptzctrl.cgi?-step=0&-act={name}&-speed={int(round(speed))}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request, move=(name, int(round(speed))))
+
+    def queue_command(self, request, move=None):
+        # Movement commands are continuous (-step=0), so a newer one replaces one on the same axis still waiting
+        # to be sent; a queued stop only gives way to another stop
+        with self.pending:
+            if move and self.commands and self.commands[-1][1] and self.axis(self.commands[-1][1]) == self.axis(move):
+                self.commands.pop()
+                metrics.inc("cgi_commands_coalesced_total", camera=self.name)
+            self.commands.append((request, move))
+            self.pending.notify()
+
+    def axis(self, move):
+        return CGIControl.AXES.get(move[0], move[0])
+
+    def command_worker(self):
+        while True:
+            with self.pending:
+                while not self.commands:
+                    self.pending.wait()
+                request, move = self.commands.popleft()
+            if move and move == self.moving:
+                # The camera is already doing this; only changes (start, stop, speed) are sent
+                metrics.inc("cgi_commands_coalesced_total", camera=self.name)
+                continue
+            if move:
+                print("Sending command", move[0])
+            start = time.time()
+            try:
+                self.command_session.get(request, timeout=self.timeout).raise_for_status()
+                self.moving = move # presets etc. move the camera on their own, so forget the last movement
+                metrics.inc("cgi_commands_sent_total", camera=self.name)
+            except Exception as err:
+                print("CGI command failed", err)
+                self.moving = None # resend the next movement
+                metrics.inc("cgi_commands_failed_total", camera=self.name)
+            latency.record(self.name, "command", time.time() - start)
 
     def ctrl_preset(self, name):
         request = f"http://{self.address}/cgi-bin/hi3510/preset.cgi?-act=goto&-number={name}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
 
     def set_preset(self, name):
         request = f"http://{self.address}/cgi-bin/hi3510/preset.cgi?-act=set&-status=1&-number={name}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
 
     def get_snapshot(self, high_quality=False, image_queue=None, local_image_queue=None):
         request = f"http://{self.address}/tmpfs/{'snap' if high_quality else 'auto'}.jpg"
-        response = requests.get(request, auth=self.auth)
+        response = self.get(request)
         content = response._content
         #if image_queue != None:
         #    if local_image_queue != None:
@@ -45,24 +109,24 @@ class CGIControl:
 
     def toggle_infrared(self, index):
         request = f"http://{self.address}/cgi-bin/hi3510/param.cgi?cmd=setinfrared&-infraredstat={CGIControl.INFRARED[index]}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
 
     def get_infrared(self):
         request = f"http://{self.address}/cgi-bin/hi3510/param.cgi?cmd=getinfrared"
-        return requests.get(request, auth=self.auth)._content.decode("utf8").strip().split("=")[-1][1:-2]
+        return self.get(request)._content.decode("utf8").strip().split("=")[-1][1:-2]
 
     def set_name(self, name):
         request = f"http://{self.address}/web/cgi-bin/hi3510/param.cgi?cmd=setoverlayattr&-region=1&-show=1&-name={quote(name)}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
 
     def set_time(self):
         current_time = datetime.now().strftime("%Y.%m.%d.%H.%M.%S")
         request = f"http://{self.address}/web/cgi-bin/hi3510/param.cgi?cmd=setservertime&-time={current_time}"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
 
     def load_config(self):
         request = f"http://{self.address}/web/cgi-bin/hi3510/param.cgi?cmd=getlanguage&cmd=getvideoattr&cmd=getimageattr&cmd=getsetupflag&cmd=getimagemaxsize&cmd=getaudioflag&cmd=getserverinfo&cmd=getvideoattr&cmd=getircutattr&cmd=getinfrared&cmd=getrtmpattr&cmd=gethttpport&cmd=getlampattrex"
-        response = requests.get(request, auth=self.auth)
+        response = self.get(request)
         config = {}
         for line in response._content.decode("utf8").strip().split("\r\n"):
             k, v = line[4:].split("=")
@@ -71,4 +135,4 @@ class CGIControl:
 
     def reboot(self):
         request = f"http://{self.address}/cgi-bin/hi3510/param.cgi?cmd=sysreboot"
-        return requests.get(request, auth=self.auth)
+        self.queue_command(request)
@@ -1,67 +1,80 @@
 from datetime import datetime
+import queue
 import time
 import numpy as np
 from io import BytesIO
 from PIL import Image
-import numpy as np
 
 from ctypes import *
-import math
-import random
-import cv2
 import darknet
 from darknet import darknet
 lib = darknet.lib
 
-def load_image(network, in_memory):
-    width = lib.network_width(network)
-    height = lib.network_height(network)
-    
-    img = np.asarray(Image.open(BytesIO(in_memory)))
-    darknet_image = lib.make_image(width, height, 3)
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img_resized = cv2.resize(img, (width, height),
-                             interpolation=cv2.INTER_LINEAR)
-    # run model on darknet style image to get detections
-    lib.copy_image_from_bytes(darknet_image, img_resized.tobytes())
+def load_image(in_memory, target):
+    # Decodes a JPEG straight into a preallocated darknet input slot (float CHW, RGB, 0-1).
+    # draft() lets libjpeg scale down while decoding, so full resolution pixels are never materialized.
+    channels, height, width = target.shape
+    image = Image.open(BytesIO(in_memory))
+    image.draft("RGB", (width, height))
+    image = image.convert("RGB").resize((width, height), Image.BILINEAR)
+    np.multiply(np.asarray(image).transpose(2, 0, 1), 1 / 255, out=target)
 
-    return darknet_image, img_rgb#image, cvimage
+def collect_batch(input_queue, batch_size):
+    # Blocks for one frame, then takes whatever else is already waiting, up to batch_size
+    batch = [input_queue.get(block=True, timeout=None)]
+    while len(batch) < batch_size:
+        try:
+            batch.append(input_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
 
-def image_process(input_queue, output_queue):
-    network, class_names, colors = darknet.load_network(config_file="darknet/cfg/yolov4.cfg", data_file="darknet/cfg/coco.data", weights="darknet/yolov4.weights", batch_size=1)
+def image_process(input_queue, output_queue, batch_size=4):
+    network, class_names, colors = darknet.load_network(config_file="darknet/cfg/yolov4.cfg", data_file="darknet/cfg/coco.data", weights="darknet/yolov4.weights", batch_size=batch_size)
     width = lib.network_width(network)
     height = lib.network_height(network)
+    lib.set_batch_network.argtypes = [c_void_p, c_int]
+
+    # Input buffers are allocated once and reused for every batch, so memory stays flat
+    buffer = np.zeros((batch_size, 3, height, width), dtype=np.float32)
+    images = darknet.IMAGE(width, height, 3, buffer.ctypes.data_as(POINTER(c_float)))
     print("AI Initialized")
     while True:
-        command = input_queue.get(block=True, timeout=None)
+        commands = collect_batch(input_queue, batch_size)
         start = time.time()
-        received = datetime.now().strftime("%Y%m%d-%H%M%S.jpg")
-        time.sleep(0.5) # We don't need 20 images per second...
-        image, cvimage = load_image(network, command)
-        
-        raw_detections = darknet.detect_image(network, class_names, image, thresh=0.7, hier_thresh=.75, nms=.45)
-        
-        img_height, img_width, _ = cvimage.shape
-        
-        detections = []
-        if raw_detections:
+        received = datetime.now().strftime("%Y%m%d-%H%M%S")
+        for i, command in enumerate(commands):
+            load_image(command, buffer[i])
+
+        # Only run as many images as arrived; the buffers stay sized for a full batch
+        lib.set_batch_network(network, len(commands))
+        batch_detections = darknet.network_predict_batch(network, images, len(commands), width, height, 0.7, .75, None, 0, 0)
+        for i, command in enumerate(commands):
+            num = batch_detections[i].num
+            raw_detections = batch_detections[i].dets
+            darknet.do_nms_obj(raw_detections, num, len(class_names), .45)
+            raw_detections = darknet.remove_negatives(raw_detections, class_names, num)
+
+            detections = []
             for detect in raw_detections:
                 label, confidence, rect = detect
                 if label == "bird":
                     x1,y1,x2,y2 = rect
                     detections.append((label,confidence,(x1/width,y1/height,x2/width,y2/height)))
-                 
-        output_queue.put(detections)
-        #print(f"Processed image in {time.time() - start} seconds")
 
-        # save image and xml
-        if detections:
-            cv2.imwrite("images/" + received, (cvimage).astype('uint8')) 
-            save_xml(detections, received)
+            output_queue.put(detections)
+
+            # save image and xml; the received JPEG is written as is rather than decoded and re-encoded
+            if detections:
+                filename = f"{received}-{i}.jpg" if len(commands) > 1 else f"{received}.jpg"
+                with open("images/" + filename, "wb") as f:
+                    f.write(command)
+                save_xml(detections, filename, size=Image.open(BytesIO(command)).size) # the header only, nothing is decoded
+        darknet.free_batch_detections(batch_detections, len(commands))
+        #print(f"Processed {len(commands)} images in {time.time() - start} seconds")
 
-def save_xml(boxes, filename):
-    width = 2560
-    height = 1440
+def save_xml(boxes, filename, size=(2560, 1440)):
+    width, height = size
     path = f"/home/shwam/Programming/birdcam/images/{filename}"
     object_template = lambda label, rect: f"""<object>
         <name>{label}</name>
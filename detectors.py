@@ -0,0 +1,265 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from queues import put_drop_oldest
+
+HALT = "halt"
+
+def beat(heartbeat, seq=-1):
+    # heartbeat is a shared [last beat time, sequence ID being worked on (-1 when idle)] array
+    heartbeat[0] = time.time()
+    heartbeat[1] = seq
+
+class Pulse:
+    """
+    Keeps a worker's heartbeat going from a side thread while it is busy with something slow
+    (loading a model, a long forward pass, waiting on the darknet server), but only until a deadline:
+    a worker still busy after that stops beating, so one that is really stuck gets restarted.
+    """
+    def __init__(self, heartbeat, interval=1):
+        self.heartbeat = heartbeat
+        self.interval = interval
+        self.seq = -1
+        self.until = 0
+        threading.Thread(target=self.run, name="pulse", daemon=True).start()
+
+    def busy(self, seq, until):
+        self.seq, self.until = seq, until
+        beat(self.heartbeat, seq)
+
+    def idle(self):
+        self.until = 0 # next_request beats while waiting
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if time.time() < self.until:
+                beat(self.heartbeat, self.seq)
+
+def next_request(requests, heartbeat, frame_pool, block=True):
+    # Waits for the next request that AI hasn't already given up on, beating the heartbeat while idle.
+    # Returns HALT when asked to stop, or None if block is False and nothing is waiting.
+    while True:
+        if block:
+            beat(heartbeat)
+        try:
+            request = requests.get(timeout=1) if block else requests.get_nowait()
+        except queue.Empty:
+            if not block:
+                return None
+            continue
+        if request is None:
+            return HALT
+        seq, data, lengths, deadline = request
+        if time.time() < deadline:
+            return request
+        if isinstance(data, tuple):
+            frame_pool.done(data[0]) # skipped, the slot can be reused
+
+def put_result(results, result, dropped):
+    # Results are bounded too; if AI isn't draining them, the oldest is dropped and counted
+    evicted = len(put_drop_oldest(results, result))
+    if evicted:
+        with dropped.get_lock():
+            dropped.value += evicted
+
+def read_request_images(data, lengths, frame_pool):
+    # Requests carry either the encoded images or a (slot, length) reference into shared memory,
+    # plus the length of each image (several when the frame was tiled)
+    if isinstance(data, tuple):
+        slot = data[0]
+        data = frame_pool.get(*data)
+        frame_pool.done(slot) # copied out, the slot can be reused
+    images = []
+    offset = 0
+    for length in lengths:
+        images.append(data[offset:offset + length])
+        offset += length
+    return images
+
+class DarknetDetector:
+    """
+    Sends frames to the darknet_server container.
+    Runs one DarknetClient connection per worker; each handles one frame at a time.
+    """
+    name = "darknet"
+
+    def __init__(self, config):
+        self.host = config.get("image_server", "localhost")
+        self.port = config.get("image_server_port", 7061)
+        self.timeout = config.get("ai_timeout", 30)
+        self.workers = max(1, config.get("ai_in_flight", 2))
+        self.max_in_flight = self.workers
+        self.input_size = config.get("ai_input_size", (608, 608))
+
+    def run(self, requests, results, frame_pool, heartbeat, dropped):
+        # A client handles one image at a time, so its next result always belongs to the request it was given.
+        from darknet_server.code.client import DarknetClient # only needed for this backend
+        images = queue.Queue()
+        boxes = queue.Queue()
+        client = DarknetClient(self.host, self.port, images, boxes)
+        threading.Thread(target=client.run, daemon=True).start()
+        pulse = Pulse(heartbeat)
+        while True:
+            request = next_request(requests, heartbeat, frame_pool)
+            if request is HALT:
+                images.put(None) # halt the client
+                return
+            seq, data, lengths, deadline = request
+            pulse.busy(seq, deadline) # a reply can take up to ai_timeout
+            detections = []
+            timings = []
+            for image in read_request_images(data, lengths, frame_pool):
+                start = time.time()
+                images.put(image)
+                try:
+                    timestamp, image_detections = boxes.get(timeout=self.timeout)
+                except queue.Empty:
+                    # The response was lost. Exit rather than risk pairing a late answer with the next request;
+                    # AI starts a fresh worker with a new connection.
+                    return
+                detections.append(image_detections)
+                timings.append(time.time() - start)
+            pulse.idle()
+            put_result(results, (seq, detections, timings), dropped)
+
+class OpenCVDetector:
+    """
+    Runs the YOLO cfg/weights in-process on the CPU with OpenCV's DNN module.
+    Each worker process loads its own copy of the network and batches whatever images are waiting.
+    """
+    name = "opencv"
+
+    def __init__(self, config):
+        detector = config.get("detector", dict())
+        self.cfg = detector.get("cfg", "darknet/cfg/yolov4.cfg")
+        self.weights = detector.get("weights", "darknet/yolov4.weights")
+        self.names = detector.get("names", "darknet/cfg/coco.names")
+        size = detector.get("input_size", 416) # must be a multiple of 32
+        self.input_size = tuple(size) if isinstance(size, (list, tuple)) else (size, size)
+        self.workers = max(1, detector.get("workers", max(1, multiprocessing.cpu_count() // 2)))
+        self.batch_size = max(1, detector.get("batch_size", 4)) # images per forward pass
+        self.threads = detector.get("threads", 2) # OpenCV threads per worker
+        self.confidence = detector.get("confidence", 0.5)
+        self.nms = detector.get("nms", 0.45)
+        self.load_timeout = detector.get("load_timeout", 300) # seconds a worker may take to load the network
+        self.max_in_flight = config.get("ai_in_flight", self.workers * self.batch_size)
+        if config.get("tiling", dict()).get("enabled", False):
+            self.max_in_flight = config.get("ai_in_flight", self.workers) # each request is already a batch of tiles
+
+    def load(self):
+        if not hasattr(cv2.dnn, "readNetFromDarknet"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} cannot load darknet models, the opencv detector needs OpenCV 4.x")
+        cv2.setNumThreads(self.threads)
+        net = cv2.dnn.readNetFromDarknet(self.cfg, self.weights)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        with open(self.names, "r") as f:
+            class_names = [line.strip() for line in f if line.strip()]
+        return net, class_names
+
+    def run(self, requests, results, frame_pool, heartbeat, dropped):
+        pulse = Pulse(heartbeat)
+        pulse.busy(-1, time.time() + self.load_timeout)
+        net, class_names = self.load()
+        pulse.idle()
+        output_names = net.getUnconnectedOutLayersNames()
+        halt = False
+        while not halt:
+            # Block for one request, then take whatever else is already waiting, up to batch_size images
+            batch = [next_request(requests, heartbeat, frame_pool)]
+            while batch[-1] not in (HALT, None) and sum(len(request[2]) for request in batch) < self.batch_size:
+                batch.append(next_request(requests, heartbeat, frame_pool, block=False))
+            halt = HALT in batch
+            batch = [request for request in batch if request not in (HALT, None)]
+            if not batch:
+                continue
+            start = time.time()
+            pulse.busy(batch[0][0], max(request[3] for request in batch))
+            images = []
+            for seq, data, lengths, deadline in batch:
+                images.extend(cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR) for image in read_request_images(data, lengths, frame_pool))
+            detections = self.detect(net, output_names, class_names, images)
+            # Images share one forward pass, so each gets an equal share of the batch time
+            timing = (time.time() - start) / len(images)
+            pulse.idle()
+            for seq, data, lengths, deadline in batch:
+                put_result(results, (seq, detections[:len(lengths)], [timing] * len(lengths)), dropped)
+                detections = detections[len(lengths):]
+
+    def detect(self, net, output_names, class_names, images):
+        # Returns a list of (label, confidence, (x, y, w, h)) detections per image, with normalized center coordinates
+        blob = cv2.dnn.blobFromImages(images, 1 / 255.0, self.input_size, swapRB=True, crop=False)
+        net.setInput(blob)
+        outputs = [output.reshape(len(images), -1, output.shape[-1]) for output in net.forward(output_names)]
+        return [self.parse(np.concatenate([output[i] for output in outputs]), class_names) for i in range(len(images))]
+
+    def parse(self, rows, class_names):
+        scores = rows[:, 5:]
+        class_ids = np.argmax(scores, axis=1)
+        confidences = scores[np.arange(len(rows)), class_ids]
+        keep = confidences >= self.confidence
+        rows, class_ids, confidences = rows[keep], class_ids[keep], confidences[keep]
+
+        detections = []
+        for class_id in np.unique(class_ids):
+            mask = class_ids == class_id
+            rects = rows[mask, :4]
+            # NMSBoxes wants top-left based boxes
+            corners = [(x - w/2, y - h/2, w, h) for x, y, w, h in rects.tolist()]
+            for i in np.array(cv2.dnn.NMSBoxes(corners, confidences[mask].tolist(), self.confidence, self.nms)).flatten():
+                x, y, w, h = rects[i].tolist()
+                detections.append((class_names[class_id], float(confidences[mask][i]), (x, y, w, h)))
+        return detections
+
+class StubDetector:
+    """
+    Returns canned detections after a configurable delay, without a model.
+    For benchmarks and load tests of everything around the detector (see bench_replay.py).
+    """
+    name = "stub"
+
+    def __init__(self, config):
+        detector = config.get("detector", dict())
+        self.latency = detector.get("latency", 0.05) # seconds per image
+        self.jitter = detector.get("jitter", 0.0) # extra random seconds per image, up to this much
+        self.decode = detector.get("decode", False) # decode each image, as a real detector would
+        self.boxes = [tuple(box) for box in detector.get("boxes", [("bird", 0.95, (0.5, 0.5, 0.1, 0.1))])]
+        self.workers = max(1, detector.get("workers", 2))
+        self.max_in_flight = config.get("ai_in_flight", self.workers)
+        size = detector.get("input_size", 608)
+        self.input_size = tuple(size) if isinstance(size, (list, tuple)) else (size, size)
+
+    def run(self, requests, results, frame_pool, heartbeat, dropped):
+        rng = np.random.default_rng()
+        pulse = Pulse(heartbeat)
+        while True:
+            request = next_request(requests, heartbeat, frame_pool)
+            if request is HALT:
+                return
+            seq, data, lengths, deadline = request
+            pulse.busy(seq, deadline)
+            detections = []
+            timings = []
+            for image in read_request_images(data, lengths, frame_pool):
+                start = time.time()
+                if self.decode:
+                    cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+                time.sleep(max(0, self.latency + self.jitter * rng.random() - (time.time() - start)))
+                detections.append(list(self.boxes))
+                timings.append(time.time() - start)
+            pulse.idle()
+            put_result(results, (seq, detections, timings), dropped)
+
+DETECTORS = {detector.name: detector for detector in (DarknetDetector, OpenCVDetector, StubDetector)}
+
+def get_detector(config):
+    detector_type = config.get("detector", dict()).get("type", "darknet")
+    if detector_type not in DETECTORS:
+        raise ValueError(f"Unknown detector type {detector_type}, expected one of {', '.join(DETECTORS)}")
+    return DETECTORS[detector_type](config)
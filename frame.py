@@ -0,0 +1,164 @@
+import io
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+class Frame:
+    """
+    A single captured camera frame.
+    Holds the original payload (JPEG bytes or a PIL image) and lazily produces
+    numpy (RGB), cv2 (BGR), pygame and JPEG views of it. Each view is computed
+    at most once and shared between every consumer of the frame.
+    """
+    FORMATS = ("numpy", "cv2", "pygame", "jpeg")
+
+    def __init__(self, payload, timestamp=None, mode=None):
+        self.payload = payload
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.mode = mode
+        self.conversions = 0 # number of JPEG decodes/encodes performed on this frame
+        self.views = dict()
+        self.lock = threading.Lock()
+        if isinstance(payload, bytes):
+            self.views["jpeg"] = payload
+        elif isinstance(payload, Image.Image):
+            self.views["pil"] = payload
+        elif isinstance(payload, np.ndarray):
+            self.views["cv2"] = payload
+        else:
+            raise TypeError(f"Cannot create a frame from {type(payload)}")
+
+    def size_hint(self):
+        # Image size read from the JPEG header, without decoding the pixels
+        data = self.views.get("jpeg")
+        if data is None:
+            return None
+        try:
+            return Image.open(io.BytesIO(data)).size
+        except Exception:
+            return None
+
+    @property
+    def size(self):
+        if "pil" in self.views:
+            return self.views["pil"].size
+        array = self.views.get("cv2", self.views.get("numpy"))
+        if array is None:
+            size = self.size_hint()
+            if size:
+                return size
+            array = self.numpy()
+        height, width = array.shape[:2]
+        return width, height
+
+    def view(self, output_format):
+        output_format = output_format.lower()
+        if output_format == "jpg":
+            output_format = "jpeg"
+        if output_format not in Frame.FORMATS:
+            raise ValueError(f"Unsupported frame format {output_format}")
+        return getattr(self, output_format)()
+
+    def numpy(self):
+        return self._get("numpy", self._to_numpy)
+
+    def cv2(self):
+        return self._get("cv2", self._to_cv2)
+
+    def pygame(self):
+        return self._get("pygame", self._to_pygame)
+
+    def jpeg(self):
+        return self._get("jpeg", self._to_jpeg)
+
+    def resized_jpeg(self, size, quality=90):
+        # JPEG of the frame scaled to size (width, height), e.g. the detector's network input
+        width, height = size
+        return self._get(f"jpeg{width}x{height}", lambda: self._to_resized_jpeg(width, height, quality))
+
+    def thumbnail_gray(self, width=160):
+        # Small grayscale copy for cheap scene analysis (e.g. motion gating)
+        return self._get(f"gray{width}", lambda: self._to_thumbnail_gray(width))
+
+    def _get(self, name, convert):
+        view = self.views.get(name)
+        if view is not None:
+            return view
+        with self.lock:
+            # Another consumer may have produced it while we waited
+            view = self.views.get(name)
+            if view is None:
+                view = convert()
+                self.views[name] = view
+            return view
+
+    # Conversions below are called with self.lock held, so they use the unlocked helpers
+
+    def _numpy(self):
+        if "numpy" not in self.views:
+            self.views["numpy"] = self._to_numpy()
+        return self.views["numpy"]
+
+    def _cv2(self):
+        if "cv2" not in self.views:
+            self.views["cv2"] = self._to_cv2()
+        return self.views["cv2"]
+
+    def _to_numpy(self):
+        if "pil" in self.views:
+            image = self.views["pil"]
+            return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+        return cv2.cvtColor(self._cv2(), cv2.COLOR_BGR2RGB)
+
+    def _to_cv2(self):
+        if "jpeg" in self.views and "numpy" not in self.views:
+            self.conversions += 1
+            return cv2.imdecode(np.frombuffer(self.views["jpeg"], np.uint8), cv2.IMREAD_COLOR)
+        return cv2.cvtColor(self._numpy(), cv2.COLOR_RGB2BGR)
+
+    def _to_pygame(self):
+        import pygame # not needed without a display
+        rgb = np.ascontiguousarray(self._numpy())
+        height, width = rgb.shape[:2]
+        return pygame.image.frombuffer(rgb, (width, height), "RGB")
+
+    def _to_thumbnail_gray(self, width):
+        if "jpeg" in self.views and "numpy" not in self.views and "cv2" not in self.views:
+            # Let libjpeg do most of the downscaling instead of decoding at full resolution
+            self.conversions += 1
+            image = cv2.imdecode(np.frombuffer(self.views["jpeg"], np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            code = None
+        elif "cv2" in self.views:
+            image, code = self.views["cv2"], cv2.COLOR_BGR2GRAY
+        else:
+            image, code = self._numpy(), cv2.COLOR_RGB2GRAY
+        height = max(1, image.shape[0] * width // image.shape[1])
+        small = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        return small if code is None else cv2.cvtColor(small, code)
+
+    def _to_resized_jpeg(self, width, height, quality):
+        if "jpeg" in self.views and "numpy" not in self.views and "cv2" not in self.views:
+            # Decode at reduced scale when the target is small enough, instead of decoding every pixel
+            data = np.frombuffer(self.views["jpeg"], np.uint8)
+            full_width, full_height = self.size_hint() or (0, 0)
+            flag = cv2.IMREAD_REDUCED_COLOR_2 if full_width >= 2 * width and full_height >= 2 * height else cv2.IMREAD_COLOR
+            self.conversions += 1
+            image = cv2.imdecode(data, flag)
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        elif "cv2" in self.views:
+            image = cv2.resize(self.views["cv2"], (width, height), interpolation=cv2.INTER_AREA)
+        else:
+            image = cv2.resize(self._numpy(), (width, height), interpolation=cv2.INTER_AREA)
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        self.conversions += 1
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+    def _to_jpeg(self):
+        image = self.views["pil"] if "pil" in self.views else Image.fromarray(self._numpy())
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format="jpeg")
+        self.conversions += 1
+        return img_byte_arr.getvalue()
@@ -0,0 +1,79 @@
+import threading
+import time
+
+class FrameBuffer:
+    """
+    Fixed-size, lock-protected ring buffer of timestamped camera Frames.
+    A single capture worker writes into it, and any number of readers (UI, AI, snapshots)
+    can grab the latest frame or the first frame captured at or after a given time.
+    """
+    def __init__(self, size=8):
+        self.size = max(2, int(size))
+        self.frames = [None] * self.size
+        self.count = 0 # total number of frames ever written
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+
+    def __len__(self):
+        with self.lock:
+            return sum(1 for frame in self.frames if frame is not None)
+
+    def put(self, frame):
+        with self.lock:
+            self.frames[self.count % self.size] = frame
+            self.count += 1
+            self.new_frame.notify_all()
+
+    def latest(self):
+        # Returns the newest frame, or None if the buffer is empty
+        with self.lock:
+            return self._latest()
+
+    def after(self, timestamp):
+        # Returns the oldest frame captured at or after timestamp, or None if there isn't one yet
+        with self.lock:
+            return self._after(timestamp)
+
+    def wait_for(self, timestamp, timeout=1.0):
+        # Blocks until a frame captured at or after timestamp is available
+        deadline = time.time() + timeout
+        with self.lock:
+            frame = self._after(timestamp)
+            while frame is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.new_frame.wait(remaining)
+                frame = self._after(timestamp)
+            return frame
+
+    def flush_mode(self, purge_mode):
+        # Drop every buffered frame that came from the given feed (e.g. "cgi")
+        with self.lock:
+            for i, frame in enumerate(self.frames):
+                if frame is not None and frame.mode == purge_mode:
+                    self.frames[i] = None
+
+    def clear(self):
+        with self.lock:
+            self.frames = [None] * self.size
+
+    def _latest(self):
+        # Walk back from the write head; bounded by the (fixed) buffer size
+        for i in range(1, self.size + 1):
+            frame = self.frames[(self.count - i) % self.size]
+            if frame is not None:
+                return frame
+        return None
+
+    def _after(self, timestamp):
+        # Frames are written in capture order, so walk back from the newest until we pass timestamp
+        found = None
+        for i in range(1, self.size + 1):
+            frame = self.frames[(self.count - i) % self.size]
+            if frame is None:
+                continue
+            if frame.timestamp < timestamp:
+                break
+            found = frame
+        return found
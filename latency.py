@@ -0,0 +1,104 @@
+import collections
+import math
+import threading
+import time
+
+# Pipeline stages, in the order a frame passes through them
+STAGES = (
+    "read",       # rtsp/cgi read in the capture thread
+    "encode",     # crop/tile/resize and JPEG encode before sending to the detector
+    "queue",      # handed to the detector but not being inferred: waiting for a worker, transfers
+    "inference",  # detector round trip for the frame's image(s)
+    "detect",     # sent to the detector until the result was collected
+    "result",     # capture until the result was collected (end to end)
+    "process",    # tracking, alerts and save decisions
+    "save",       # image and annotation writes
+    "display",    # scaling, overlay and flip in the UI
+    "command",    # camera control (PTZ, presets) round trip
+)
+
+class LatencyHistograms:
+    """
+    Rolling latency samples per camera and stage, summarized as p50/p95/p99 on request, plus
+    running count and sum totals since start (for the metrics endpoint's summary _count/_sum).
+    Recording is a deque append and two additions, cheap enough to leave on in production.
+    """
+    def __init__(self, window=60, max_samples=2048):
+        self.window = window # seconds of samples kept
+        self.max_samples = max_samples # per camera and stage
+        self.samples = dict() # (camera, stage) -> deque of (time recorded, seconds)
+        self.running = dict() # (camera, stage) -> [count, sum of seconds], never reset
+        self.lock = threading.Lock()
+        self.log_thread = None
+
+    def record(self, camera, stage, seconds):
+        key = camera, stage
+        samples = self.samples.get(key)
+        if samples is None:
+            with self.lock:
+                samples = self.samples.setdefault(key, collections.deque(maxlen=self.max_samples))
+                self.running.setdefault(key, [0, 0.0])
+        samples.append((time.time(), seconds))
+        with self.lock:
+            running = self.running[key]
+            running[0] += 1
+            running[1] += seconds
+
+    def summary(self):
+        # {camera: {stage: {count, mean, p50, p95, p99}}}, milliseconds, over the last window seconds
+        cutoff = time.time() - self.window
+        with self.lock:
+            keys = list(self.samples)
+        result = dict()
+        for camera, stage in sorted(keys, key=lambda key: (key[0], STAGES.index(key[1]) if key[1] in STAGES else len(STAGES))):
+            values = sorted(seconds for recorded, seconds in list(self.samples[camera, stage]) if recorded >= cutoff)
+            if not values:
+                continue
+            result.setdefault(camera, dict())[stage] = {
+                "count": len(values),
+                "mean": round(1000 * sum(values) / len(values), 1),
+                "p50": round(1000 * percentile(values, 50), 1),
+                "p95": round(1000 * percentile(values, 95), 1),
+                "p99": round(1000 * percentile(values, 99), 1),
+            }
+        return result
+
+    def totals(self):
+        # {(camera, stage): (count, seconds)} since start
+        with self.lock:
+            return {key: tuple(running) for key, running in self.running.items()}
+
+    def median(self, camera, stage, default=None):
+        # p50 in seconds over the window, for components that adapt to measured latency
+        cutoff = time.time() - self.window
+        values = sorted(seconds for recorded, seconds in list(self.samples.get((camera, stage), ())) if recorded >= cutoff)
+        return percentile(values, 50) if values else default
+
+    def log_line(self):
+        parts = []
+        for camera, stages in self.summary().items():
+            parts.append(f"{camera}: " + " ".join(f"{stage} {stats['p50']:.0f}/{stats['p95']:.0f}/{stats['p99']:.0f}ms" for stage, stats in stages.items()))
+        return "Latency p50/p95/p99 " + " | ".join(parts) if parts else None
+
+    def start_logging(self, interval):
+        # Prints a summary line every interval seconds
+        if not interval or self.log_thread:
+            return
+        self.log_thread = threading.Thread(target=self.log_worker, args=[interval], name="latency log", daemon=True)
+        self.log_thread.start()
+
+    def log_worker(self, interval):
+        while True:
+            time.sleep(interval)
+            line = self.log_line()
+            if line:
+                print(line)
+
+def percentile(values, p):
+    # Nearest-rank percentile of sorted values
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+# Shared by every camera in the process
+histograms = LatencyHistograms()
+record = histograms.record
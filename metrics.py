@@ -0,0 +1,119 @@
+import threading
+
+import latency
+
+# name -> (type, help). Every metric is exported as birdcam_<name>.
+METRICS = {
+    "frames_captured_total": ("counter", "Frames read from the camera"),
+    "frames_displayed_total": ("counter", "Frames drawn in the UI"),
+    "frames_skipped_total": ("counter", "Frames not sent to the detector because nothing moved"),
+    "ai_requests_sent_total": ("counter", "Frames sent to the detector"),
+    "ai_requests_completed_total": ("counter", "Detector results received"),
+    "ai_requests_timed_out_total": ("counter", "Detector requests that never got an answer"),
+    "ai_requests_dropped_total": ("counter", "Detector requests dropped because the detector was behind"),
+    "ai_results_late_total": ("counter", "Detector results that arrived after their request was dropped"),
+    "ai_results_dropped_total": ("counter", "Detector results dropped because nothing was collecting them"),
+    "ai_in_flight": ("gauge", "Detector requests waiting for a result"),
+    "ai_queue_depth": ("gauge", "Requests waiting for a free detector worker"),
+    "ai_healthy": ("gauge", "1 while the detector workers are responsive"),
+    "ai_workers": ("gauge", "Detector worker processes running"),
+    "inference_rate": ("gauge", "Inferences per second granted by the scheduler"),
+    "detections_total": ("counter", "Objects detected, by label"),
+    "tracks": ("gauge", "Objects currently tracked, by label"),
+    "images_saved_total": ("counter", "Detection images written to disk"),
+    "bytes_written_total": ("counter", "Bytes of images and annotations written to disk"),
+    "storage_queue_depth": ("gauge", "Images waiting to be written"),
+    "storage_dropped_total": ("counter", "Images dropped because storage fell behind"),
+    "cgi_commands_sent_total": ("counter", "Camera control commands sent over CGI"),
+    "cgi_commands_coalesced_total": ("counter", "Camera movement commands not sent because a newer or identical one replaced them"),
+    "cgi_commands_failed_total": ("counter", "Camera control commands that failed"),
+    "onvif_commands_sent_total": ("counter", "Camera control commands sent over ONVIF"),
+    "onvif_commands_coalesced_total": ("counter", "ONVIF movements not sent because a newer or identical one replaced them"),
+    "onvif_commands_failed_total": ("counter", "ONVIF camera control commands that failed"),
+    "camera_events_total": ("counter", "Motion and analytics events received from the camera, by topic"),
+    "camera_events_subscribed": ("gauge", "1 while the camera's events are being received"),
+    "autotrack_moves_total": ("counter", "Camera movements commanded by the auto tracker"),
+    "autotrack_following": ("gauge", "1 while the auto tracker is following a target"),
+    "alerts_total": ("counter", "Alerts dispatched, by kind"),
+    "stage_latency_seconds": ("summary", "Time spent in each pipeline stage"),
+}
+
+class Metrics:
+    """
+    Counters and gauges, served in the Prometheus text exposition format (see render).
+    Values are either counted as they happen with inc, or read from an existing
+    attribute when scraped with collect, e.g. collect("ai_workers", lambda: len(pool.workers)).
+    """
+    def __init__(self):
+        self.values = dict() # name -> {labels: value}
+        self.collectors = [] # (name, labels, function)
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values.setdefault(name, dict())
+            values[key] = values.get(key, 0) + amount
+
+    def collect(self, name, function, **labels):
+        # function returns a number, or {label value: number} for the "label" label (e.g. tracks per label)
+        with self.lock:
+            self.collectors.append((name, tuple(sorted(labels.items())), function))
+
+    def samples(self):
+        # {name: {labels: value}} of everything counted and collected so far
+        with self.lock:
+            result = {name: dict(values) for name, values in self.values.items()}
+            collectors = list(self.collectors)
+        for name, labels, function in collectors:
+            try:
+                value = function()
+            except Exception:
+                continue # e.g. the component is shutting down
+            values = result.setdefault(name, dict())
+            if isinstance(value, dict):
+                for label, count in value.items():
+                    values[tuple(sorted(labels + (("label", label),)))] = count
+            else:
+                values[labels] = value
+        return result
+
+    def render(self):
+        samples = self.samples()
+        for camera, stages in latency.histograms.summary().items():
+            for stage, stats in stages.items():
+                values = samples.setdefault("stage_latency_seconds", dict())
+                for quantile, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99")):
+                    values[(("camera", camera), ("quantile", quantile), ("stage", stage))] = round(stats[key] / 1000, 4)
+        totals = latency.histograms.totals()
+        if totals:
+            samples.setdefault("stage_latency_seconds", dict())
+        lines = []
+        for name, values in samples.items():
+            kind, text = METRICS.get(name, ("untyped", name))
+            lines.append(f"# HELP birdcam_{name} {text}")
+            lines.append(f"# TYPE birdcam_{name} {kind}")
+            for labels, value in sorted(values.items()):
+                lines.append(f"birdcam_{name}{format_labels(labels)} {format_value(value)}")
+            if name == "stage_latency_seconds":
+                # A summary's _count and _sum are totals since start, while its quantiles cover the latency window
+                for (camera, stage), (count, seconds) in sorted(totals.items()):
+                    labels = (("camera", camera), ("stage", stage))
+                    lines.append(f"birdcam_{name}_sum{format_labels(labels)} {format_value(round(seconds, 4))}")
+                    lines.append(f"birdcam_{name}_count{format_labels(labels)} {format_value(count)}")
+        return "text/plain; version=0.0.4; charset=utf-8", ("\n".join(lines) + "\n").encode("utf8")
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+# Shared by every camera in the process
+registry = Metrics()
+inc = registry.inc
+collect = registry.collect
@@ -0,0 +1,94 @@
+import time
+
+import cv2
+import numpy as np
+
+from tiling import roi_region
+
+class MotionGate:
+    """
+    Decides whether a camera frame is worth sending to the detector.
+    Keeps a running background model of a small, blurred grayscale copy of the scene and
+    only lets a frame through when enough of it has changed, when birds were recently seen,
+    or when the keep-alive interval has passed (so slow-moving birds are still caught).
+    """
+    def __init__(self, config):
+        motion = config.get("motion", dict())
+        self.enabled = motion.get("enabled", True)
+        self.width = motion.get("width", 160) # width of the downscaled frame that gets compared
+        self.pixel_threshold = motion.get("pixel_threshold", 25) # gray level change that counts as motion
+        self.area_threshold = motion.get("area_threshold", 0.002) # fraction of changed pixels needed to send
+        self.learning_rate = motion.get("learning_rate", 0.05) # how fast the background adapts
+        self.keep_alive = motion.get("keep_alive", 10) # always send at least this often (seconds)
+        self.hold = motion.get("hold", 5) # keep sending for this long after a detection or camera event (seconds)
+        self.source = motion.get("source", "frames") # "frames" to compare frames here, "camera" for the camera's own motion events (ONVIF)
+        self.debug = False
+
+        self.background = None
+        self.reseed = False # whether the next frame replaces the background without counting as motion
+        self.last_frame = None
+        self.last_sent = 0
+        self.last_detection = 0
+        self.motion_amount = 0
+        self.moving = False # whether the last frame looked at had motion
+        self.camera_events = False # whether the camera's motion events are being received
+        self.camera_moving = False
+        self.last_event = 0
+        self.sent = 0
+        self.skipped = 0
+
+    def reset(self):
+        # Forget the background while the camera moves, so its own movement isn't taken for motion.
+        # The next frame becomes the background; keep_alive and hold still send frames meanwhile
+        self.background = None
+        self.reseed = True
+
+    def camera_event(self, active):
+        # Motion reported by the camera: True/False for a state change, None for a one-off event
+        if active is not None:
+            self.camera_moving = active
+        self.last_event = time.time()
+
+    def notify_detections(self, boxes):
+        if boxes:
+            self.last_detection = time.time()
+
+    def should_send(self, frame, roi=None):
+        if frame is self.last_frame:
+            return False # nothing new to look at
+        self.last_frame = frame
+        now = time.time()
+        moved = self.moving = self.update(frame, roi)
+        send = (not self.enabled or moved
+            or now - self.last_sent > self.keep_alive
+            or now - self.last_detection < self.hold)
+        if send:
+            self.last_sent = now
+            self.sent += 1
+        else:
+            self.skipped += 1
+        if self.debug:
+            print(f"Motion: {self.motion_amount:.4f} {'sending' if send else 'skipping'} ({self.sent} sent, {self.skipped} skipped)")
+        return send
+
+    def update(self, frame, roi=None):
+        # Compare the frame (or just its region of interest) against the background model, then fold it into the model
+        if not self.enabled:
+            return True
+        if self.source == "camera" and self.camera_events:
+            self.motion_amount = float(self.camera_moving)
+            return self.camera_moving or time.time() - self.last_event < self.hold
+        gray = frame.thumbnail_gray(self.width)
+        if roi:
+            x, y, w, h = roi_region(roi, (gray.shape[1], gray.shape[0]))
+            gray = gray[y:y+h, x:x+w]
+        gray = cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            moved, self.reseed = not self.reseed, False
+            self.motion_amount = float(moved)
+            return moved
+        diff = cv2.absdiff(gray, self.background)
+        self.motion_amount = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        return self.motion_amount > self.area_threshold
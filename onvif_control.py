@@ -1,6 +1,14 @@
+import collections
 import logging
-import onvif
-from onvif import ONVIFCamera
+import threading
+import time
+
+from util import camera_name
+import latency
+import metrics
+
+PULLPOINT = "http://www.onvif.org/ver10/events/wsdl/PullPointSubscription"
+SUBSCRIPTION_MANAGER = "{http://www.onvif.org/ver10/events/wsdl}SubscriptionManagerBinding"
 
 class ONVIFControl:
     def __init__(self, config):
@@ -8,11 +16,57 @@ class ONVIFControl:
         self.__cam_user = config["onvif"].get("user", config["user"])
         self.__cam_password = config["onvif"].get("password", config["password"])
         self.__cam_port = config["onvif"].get("port", 80)
+        self.cache_path = config["onvif"].get("cache", ".onvif_cache.sqlite") # WSDL/schema documents, kept across restarts
         print(config["onvif"])
-        try:
-            self.camera_start()
-        except Exception as err:
-            print("Failed to establish ONVIF connection")
+        self.name = camera_name(config)
+        self.mycam = None
+        self.lock = threading.RLock() # connection and services, shared with the events thread
+        self.services = dict() # created on first use
+        self.spare_subscription = None
+        self.profile = None
+        self.presets = None # cached GetPresets response, refreshed after presets change
+
+        # Every SOAP call runs in order on a background thread, starting with the connection,
+        # so the UI never waits on the camera
+        self.commands = collections.deque()
+        self.pending = threading.Condition()
+        self.velocity = None # (pan, tilt, zoom) of the last ContinuousMove the camera was sent
+        self.thread = threading.Thread(target=self.command_worker, name=f"onvif {self.name}", daemon=True)
+        self.thread.start()
+
+    def move(self, pan, tilt, zoom):
+        # Queues a ContinuousMove. Only velocity changes are sent
+        self.queue_command(self.continuous_move, pan, tilt, zoom, velocity=(float(pan), float(tilt), float(zoom)))
+
+    def queue_command(self, function, *args, velocity=None):
+        # A move waiting behind another move replaces it
+        with self.pending:
+            if velocity and self.commands and self.commands[-1][2]:
+                self.commands.pop()
+                metrics.inc("onvif_commands_coalesced_total", camera=self.name)
+            self.commands.append((function, args, velocity))
+            self.pending.notify()
+
+    def command_worker(self):
+        while True:
+            with self.pending:
+                while not self.commands:
+                    self.pending.wait()
+                function, args, velocity = self.commands.popleft()
+            if velocity and velocity == self.velocity:
+                metrics.inc("onvif_commands_coalesced_total", camera=self.name)
+                continue
+            start = time.time()
+            try:
+                self.connect()
+                function(*args)
+                self.velocity = velocity # presets etc. move the camera on their own, so forget the last velocity
+                metrics.inc("onvif_commands_sent_total", camera=self.name)
+            except Exception as err:
+                print(f"ONVIF {function.__name__} failed", err)
+                self.velocity = None
+                metrics.inc("onvif_commands_failed_total", camera=self.name)
+            latency.record(self.name, "command", time.time() - start)
 
     @staticmethod
     def _map_onvif_to_vapix(value, min_onvif, max_onvif, min_vapix, max_vapix):
@@ -24,19 +78,89 @@ class ONVIFControl:
 
     def camera_start(self):
         """
-        Creates the connection to the camera using the onvif protocol
+        Creates the connection to the camera using the onvif protocol.
+        Media and PTZ services are created the first time they're used; onvif-zeep itself always
+        creates the device management and events services (and a PullPoint subscription) when it
+        connects. All of them share one HTTP session and an on-disk cache of the documents their WSDLs import.
         Returns:
-            Return the ptz service object and media service object
+            Return the ONVIFCamera
         """
-        self.mycam = ONVIFCamera(self.__cam_ip, self.__cam_port, self.__cam_user, self.__cam_password)  ## Some cameras use port 8080
-        self.camera_media = self.mycam.create_media_service()
-        self.camera_ptz = self.mycam.create_ptz_service()
-        self.events = self.mycam.create_events_service()
-        self.device_mgmt = self.mycam.create_devicemgmt_service()
-        self.camera_media_profile = self.camera_media.GetProfiles()[0]
-        logging.info('Loaded camera ONVIF media profile')
+        from onvif import ONVIFCamera
+        from zeep.cache import SqliteCache
+        from zeep.transports import Transport
+        transport = Transport(cache=SqliteCache(path=self.cache_path, timeout=30 * 24 * 3600))
+        self.mycam = ONVIFCamera(self.__cam_ip, self.__cam_port, self.__cam_user, self.__cam_password, transport=transport)  ## Some cameras use port 8080
+        self.services = dict()
+        self.profile = None
+        self.spare_subscription = self.mycam.xaddrs.get(PULLPOINT) # the one onvif-zeep made, for subscribe_events to take over
+        return self.mycam
 
-        return self.camera_ptz, self.camera_media_profile
+    def connect(self):
+        with self.lock:
+            if self.mycam is None:
+                self.camera_start()
+            return self.mycam
+
+    def service(self, name):
+        with self.lock:
+            if name not in self.services:
+                start = time.time()
+                self.services[name] = getattr(self.connect(), f"create_{name}_service")()
+                print(f"ONVIF: Created {name} service in {time.time() - start:.2f}s")
+            return self.services[name]
+
+    def subscribe_events(self, termination=120):
+        """
+        Operation to subscribe to the camera's events (motion, analytics) through a PullPoint.
+        The first call takes over the subscription onvif-zeep creates when connecting, since cameras
+        only allow a few; later calls create a new one.
+        Args:
+            termination: seconds until the subscription expires unless renewed.
+        Returns:
+            Return the PullPoint service (PullMessages) and the subscription manager (Renew, Unsubscribe)
+        """
+        with self.lock:
+            self.connect()
+            address, self.spare_subscription = self.spare_subscription, None
+            events = self.events
+        # SOAP calls are made outside the lock, so they never hold up the command worker
+        reused = address is not None
+        if not reused:
+            subscription = events.CreatePullPointSubscription({'InitialTerminationTime': f"PT{int(termination)}S"})
+            address = subscription.SubscriptionReference.Address._value_1
+        with self.lock:
+            self.mycam.xaddrs[PULLPOINT] = address
+            pullpoint = self.mycam.create_pullpoint_service()
+        manager = pullpoint.zeep_client.create_service(SUBSCRIPTION_MANAGER, address)
+        if reused:
+            manager.Renew(TerminationTime=f"PT{int(termination)}S") # it was made with the camera's default lifetime
+        logging.info('camera_command( subscribe_events() ) at %s', address)
+        return pullpoint, manager
+
+    @property
+    def camera_media(self):
+        return self.service("media")
+
+    @property
+    def camera_ptz(self):
+        return self.service("ptz")
+
+    @property
+    def events(self):
+        # onvif-zeep creates the events service when connecting; only make one if that failed
+        mycam = self.connect()
+        return getattr(mycam, "event", None) or self.service("events")
+
+    @property
+    def device_mgmt(self):
+        return self.mycam.devicemgmt # created when connecting
+
+    @property
+    def camera_media_profile(self):
+        if self.profile is None:
+            self.profile = self.camera_media.GetProfiles()[0]
+            logging.info('Loaded camera ONVIF media profile')
+        return self.profile
 
     def absolute_move(self, pan: float, tilt: float, zoom: float):
         """
@@ -152,7 +276,7 @@ class ONVIFControl:
         """
         preset_name=f"Preset{str(key).zfill(3)}"
         self.remove_preset(preset_name)
-        presets = ONVIFControl.get_preset_complete(self)
+        presets = self.get_preset_complete()
         request = self.camera_ptz.create_type('SetPreset')
         request.ProfileToken = self.camera_media_profile.token
         request.PresetName = preset_name
@@ -165,6 +289,7 @@ class ONVIFControl:
                 return None
 
         ptz_set_preset = self.camera_ptz.SetPreset(request)
+        self.presets = None # the new token is only known to the camera
         logging.info('Preset (\'%s\') created!', preset_name)
         return ptz_set_preset
 
@@ -174,7 +299,7 @@ class ONVIFControl:
         Returns:
             Returns a list of tuples with the presets.
         """
-        ptz_get_presets = ONVIFControl.get_preset_complete(self)
+        ptz_get_presets = self.get_preset_complete()
         logging.info('camera_command( get_preset() )')
 
         presets = []
@@ -184,14 +309,15 @@ class ONVIFControl:
 
     def get_preset_complete(self):
         """
-        Operation to request all PTZ presets.
+        Operation to request all PTZ presets. Cached until a preset is set or removed.
         Returns:
             Returns the complete presets Onvif.
         """
-        request = self.camera_ptz.create_type('GetPresets')
-        request.ProfileToken = self.camera_media_profile.token
-        ptz_get_presets = self.camera_ptz.GetPresets(request)
-        return ptz_get_presets
+        if self.presets is None:
+            request = self.camera_ptz.create_type('GetPresets')
+            request.ProfileToken = self.camera_media_profile.token
+            self.presets = list(self.camera_ptz.GetPresets(request))
+        return self.presets
 
     def remove_preset(self, preset_name: str):
         """
@@ -201,7 +327,7 @@ class ONVIFControl:
         Returns:
             Return onvif's response.
         """
-        presets = ONVIFControl.get_preset_complete(self)
+        presets = self.get_preset_complete()
         request = self.camera_ptz.create_type('RemovePreset')
         request.ProfileToken = self.camera_media_profile.token
         logging.info('camera_command( remove_preset(%s) )', preset_name)
@@ -209,6 +335,7 @@ class ONVIFControl:
             if str(presets[i].Name) == preset_name:
                 request.PresetToken = presets[i].token
                 ptz_remove_preset = self.camera_ptz.RemovePreset(request)
+                self.presets = [preset for preset in presets if preset is not presets[i]]
                 logging.info('Preset (\'%s\') removed!', preset_name)
                 return ptz_remove_preset
         logging.warning("Preset (\'%s\') not found!", preset_name)
@@ -245,4 +372,5 @@ if __name__ == "__main__":
     import util
     config = util.load_config(".config")
     onv = ONVIFControl(config)
-    onv.continuous_move(1,1,1) 
+    onv.move(1,1,1)
+    time.sleep(5) # commands are sent in the background
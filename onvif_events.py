@@ -0,0 +1,99 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+
+import metrics
+
+class ONVIFEvents:
+    """
+    Follows the camera's own motion and analytics events through an ONVIF PullPoint subscription,
+    so the camera's motion detector decides when frames are worth sending to the detector.
+    Events raise the camera's inference rate in the scheduler, and with "motion": {"source": "camera"}
+    they replace the frame differencing in the motion gate.
+    """
+    def __init__(self, config, onvif, ai):
+        events = config["onvif"].get("events", dict())
+        events = events if isinstance(events, dict) else dict() # "events": True for the defaults
+        self.topics = events.get("topics", ["Motion", "ObjectDetection", "FieldDetector", "LineDetector"]) # topics containing any of these count
+        self.pull_timeout = events.get("pull_timeout", 10) # seconds the camera may hold a pull open
+        self.termination = events.get("termination", 120) # seconds a subscription lives unless renewed
+        self.retry = events.get("retry", 10) # seconds to wait before subscribing again after an error
+        self.onvif = onvif
+        self.ai = ai
+        self.name = ai.name
+        self.subscribed = False
+        self.received = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, name=f"events {self.name}", daemon=True)
+        self.thread.start()
+        metrics.collect("camera_events_subscribed", lambda: int(self.subscribed), camera=self.name)
+
+    def stop(self):
+        self.running = False
+
+    def worker(self):
+        while self.running:
+            manager = None
+            try:
+                pullpoint, manager = self.onvif.subscribe_events(self.termination)
+                self.set_subscribed(True)
+                print(f"Events: Subscribed to {self.name}")
+                renewed = time.time()
+                while self.running:
+                    for topic, message in self.pull(pullpoint):
+                        self.handle(topic, message)
+                    if time.time() - renewed > self.termination / 2:
+                        manager.Renew(TerminationTime=f"PT{int(self.termination)}S")
+                        renewed = time.time()
+            except Exception as err:
+                print(f"Events: Lost the subscription to {self.name}, retrying in {self.retry}s", err)
+            self.set_subscribed(False)
+            if manager is not None:
+                try:
+                    manager.Unsubscribe()
+                except Exception:
+                    pass # the camera drops it when it expires
+            if self.running:
+                time.sleep(self.retry)
+
+    def set_subscribed(self, subscribed):
+        # Without events the motion gate falls back to comparing frames
+        self.subscribed = subscribed
+        self.ai.motion.camera_events = subscribed
+
+    def pull(self, pullpoint):
+        # Read as raw XML: zeep drops the text of wsnt:Topic (mixed content), which says what the event is
+        with pullpoint.zeep_client.settings(raw_response=True):
+            response = pullpoint.ws_client.PullMessages(Timeout=timedelta(seconds=self.pull_timeout), MessageLimit=32)
+        response.raise_for_status()
+        return notifications(response.content)
+
+    def handle(self, topic, message):
+        if not any(name in topic for name in self.topics):
+            return
+        active = message_state(message)
+        self.received += 1
+        metrics.inc("camera_events_total", camera=self.name, topic=topic.split(":")[-1])
+        if self.ai.debug:
+            print(f"Events: {topic} {active} from {self.name}")
+        self.ai.camera_motion(active)
+
+def notifications(content):
+    # (topic, tt:Message) for each wsnt:NotificationMessage in a PullMessages response
+    root = ET.fromstring(content)
+    return [(notification.findtext("{*}Topic", "").strip(), notification.find("{*}Message/{*}Message"))
+            for notification in root.iterfind(".//{*}NotificationMessage")]
+
+def message_state(message):
+    # State of a tt:Message, e.g. <tt:Data><tt:SimpleItem Name="IsMotion" Value="true"/></tt:Data>.
+    # None for events without a true/false state, which count as a single pulse of activity.
+    if message is None:
+        return None
+    for item in message.iterfind(".//{*}Data/{*}SimpleItem"):
+        value = str(item.get("Value")).lower()
+        if value in ("true", "1"):
+            return True
+        if value in ("false", "0"):
+            return False
+    return None
@@ -0,0 +1,277 @@
+import os
+import datetime
+import subprocess
+import threading
+import time
+import json
+import queue
+
+import util
+from queues import put_drop_oldest
+from tracker import Tracker
+from autotrack import AutoTracker
+import latency
+import metrics
+
+class Alerts:
+    """Sounds, speech and floodlights. One per process, shared by every camera in it."""
+    def __init__(self, CONFIG):
+        self.muted = False
+        self.audio_dir = CONFIG.get("audio_dir", "audio")
+        self.audio_files = util.get_audio_files(self.audio_dir)
+        self.last_chirp = dict()
+        self.lock = threading.Lock()
+        self.light_names = []
+        self.bridge = None
+        if "hue" in CONFIG:
+            from hue import get_bridge
+            self.bridge = get_bridge(CONFIG["hue"]["address"], CONFIG["hue"]["user"])
+            self.light_names = CONFIG["hue"]["light_names"]
+
+    def chirp(self, chirp_type="bird.wav"):
+        if chirp_type[:4]=="bear" and datetime.datetime.now().hour > 5 and datetime.datetime.now().hour < 22:
+            return # It's probably not a true bear if it's in the day
+        with self.lock:
+            if time.time() <= self.last_chirp.get(chirp_type, time.time() - 1):
+                return
+            self.last_chirp[chirp_type] = time.time() + 360
+        metrics.inc("alerts_total", kind="chirp")
+        subprocess.Popen(['ffplay', os.path.join(self.audio_dir, chirp_type), '-nodisp', '-autoexit'],
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+
+    def speak(self, text):
+        metrics.inc("alerts_total", kind="speech")
+        from gtts import gTTS # only needed once someone is around to hear it
+        myobj = gTTS(text=text, lang="en", slow=False)
+
+        obj_path = os.path.join(self.audio_dir, "voice.mp3")
+        myobj.save(obj_path)
+        os.system(f"(ffplay {obj_path} -autoexit -nodisp -af 'volume=0.1' > /dev/null 2>&1)&")
+
+    def intruder(self):
+        if self.bridge:
+            print("INTRUDER! Activating floodlight")
+            metrics.inc("alerts_total", kind="floodlight")
+            from hue import intruder_thread_start
+            intruder_thread_start(self.bridge, self.light_names)
+
+class Storage:
+    """Writes detection images and annotations on a background thread, so saving never stalls a camera loop"""
+    def __init__(self, size=32):
+        self.jobs = queue.Queue(size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.worker, name="storage", daemon=True)
+        self.thread.start()
+        metrics.collect("storage_queue_depth", self.jobs.qsize)
+        metrics.collect("storage_dropped_total", lambda: self.dropped)
+
+    def save(self, frame, boxes, fpath, thumbnail=None, camera=None):
+        dropped = len(put_drop_oldest(self.jobs, (frame, boxes, fpath, thumbnail, camera)))
+        if dropped:
+            self.dropped += dropped
+            print(f"Storage: Falling behind, dropped {dropped} image(s)")
+
+    def worker(self):
+        while True:
+            frame, boxes, fpath, thumbnail, camera = self.jobs.get()
+            start = time.time()
+            try:
+                image = frame.jpeg() # full resolution
+                with open(fpath, "wb") as f:
+                    f.write(image)
+                written = len(image)
+                if thumbnail:
+                    with open(thumbnail, "wb") as f:
+                        f.write(image)
+                    written += len(image)
+                written += util.save_xml(boxes, fpath, frame.size)
+                metrics.inc("images_saved_total", camera=camera)
+                metrics.inc("bytes_written_total", written, camera=camera)
+                latency.record(camera, "save", time.time() - start)
+            except Exception as err:
+                print(f"Could not save {fpath} - out of disk space?", err)
+
+class Pipeline:
+    """
+    Detection handling for one camera: collects results from its AI, follows them with a tracker,
+    and alerts, saves and reports per bird. Runs with or without a UI on top.
+    """
+    IGNORED_CLASSES = ("chair", "cake", "fire hydrant", "bird", "frisbee", "bowl", "spoon", "car", "clock", "parking meter", "cup", "bench", "umbrella", "vase")
+
+    def __init__(self, CONFIG, cam, ai, alerts=None, storage=None):
+        self.debug = False
+        self.cam = cam
+        self.ai = ai
+        self.alerts = alerts or Alerts(CONFIG)
+        self.storage = storage or Storage()
+        self.tracker = Tracker(CONFIG)
+        self.autotrack = AutoTracker(CONFIG, cam, self.tracker)
+        self.save_interval = CONFIG.get("track_save_interval", 10) # seconds between saved images of the same track
+        self.bird_count = 0
+        self.last_event = []
+        self.config_path = CONFIG["config_path"]
+        self.config = CONFIG
+
+        metrics.collect("tracks", self.track_counts, camera=ai.name)
+
+        # The camera's own motion events, if it has them
+        self.events = None
+        if cam.onvif and CONFIG["onvif"].get("events"):
+            from onvif_events import ONVIFEvents
+            self.events = ONVIFEvents(CONFIG, cam.onvif, ai)
+
+        cam.set_name("birdcam")
+        cam.set_time()
+        self.write_bird_count(0)
+
+    def step(self):
+        # Collect any finished detections and keep the detector fed. Returns the boxes received, if any.
+        self.cam.restore_rtsp()
+        boxes, timestamp, frame = self.ai.get_detections(self.cam)
+        start = time.time()
+        self.process_boxes(boxes, timestamp, frame)
+        self.autotrack.update()
+        if frame is not None:
+            latency.record(self.ai.name, "process", time.time() - start)
+        return boxes
+
+    def stop(self):
+        self.autotrack.release()
+        if self.events:
+            self.events.stop()
+
+    def snapshot(self):
+        # Latest frame as a JPEG, for viewers attached to a headless service
+        frame = self.cam.latest_frame()
+        if frame is None:
+            return None
+        return "image/jpeg", frame.jpeg()
+
+    def tracks(self):
+        # Live tracks predicted to now, for viewers to draw over the snapshot
+        return {"timestamp": time.time(), "boxes": self.tracker.boxes(time.time()), "target": self.autotrack.target, "ai": self.ai.status()}
+
+    def track_counts(self):
+        counts = dict()
+        for track in list(self.tracker.tracks.values()):
+            counts[track.label] = counts.get(track.label, 0) + 1
+        return counts
+
+    def check_connection(self):
+        # Ensure the connections are still alive
+        self.cam.check_connection()
+        self.ai.check_connection()
+
+    def process_boxes(self, boxes, timestamp, frame):
+        # Follow detections across frames, so alerts and saves happen per bird rather than per frame
+        now = time.time()
+        for track in self.tracker.expire(now):
+            if self.debug:
+                print(f"Track {track.id} ({track.label}) ended after {track.last_seen - track.start:.1f}s")
+        tracks = []
+        if frame is not None:
+            tracks, started = self.tracker.update(boxes, frame.timestamp)
+            if self.debug:
+                for track in started:
+                    print(f"Track {track.id} ({track.label}) started")
+        self.update_bird_count()
+        if not tracks:
+            return
+        labels_present = dict()
+        auto_screenshot_labels = self.config.get("auto_screenshot_labels", [])
+        alerts = self.alerts
+        save = False
+
+        # Extract detections of high confidence
+        for track in tracks:
+            label, confidence = track.label, track.confidence
+            if confidence > 0.9 and track.once("alert"):
+                if label not in self.IGNORED_CLASSES and not alerts.muted:
+                    alerts.speak(label.replace("person", "intruder"))
+                if label in ["person", "bear", "car", "truck"]:
+                    alerts.intruder()
+            if confidence > 0.8:
+                labels_present[label] = labels_present.get(label, 0) + 1
+                if not alerts.muted and label in alerts.audio_files and (label not in self.IGNORED_CLASSES or label in auto_screenshot_labels) and track.once("chirp"):
+                    # play the relevant alert sound
+                    alerts.chirp(alerts.audio_files[label])
+                if label in auto_screenshot_labels and (track.last_saved is None or now - track.last_saved > self.save_interval):
+                    save = True
+
+        # Check for labels of interest
+        labels_of_interest = sorted([label for label in labels_present if label in auto_screenshot_labels])
+        if not save:
+            labels_of_interest = []
+        for track in tracks:
+            if track.label in labels_of_interest:
+                track.last_saved = now
+
+        if labels_of_interest:
+            print(f"DETECTED: {boxes}")
+            current_timestamp = datetime.datetime.strptime(timestamp, "%y%m%d%H%M%S%f")
+
+            # Split up path, to make it easier to search through & host as an image server
+            yy = timestamp[:2]
+            mm = timestamp[2:4]
+            dd = timestamp[4:6]
+            if self.last_event and (current_timestamp-self.last_event[-1]) < datetime.timedelta(seconds=7):
+                # Add this on to the last event, if not much time has passed
+                self.last_event.append(current_timestamp)
+
+            else:
+                # Start a new event
+                self.last_event = [current_timestamp,]
+            label_list="_".join(labels_of_interest)
+            directory = os.path.join(self.config.get("output_dir", "images"), yy, mm, dd, f"{self.last_event[0].strftime('%H%M%S')}_{label_list}")
+            os.makedirs(directory, exist_ok=True)
+
+            fpath = os.path.join(directory, timestamp + ".jpg")
+            thumbnail = os.path.join(directory, ".thumb.jpg") if len(self.last_event) == 1 else None
+            self.storage.save(frame, boxes, fpath, thumbnail, self.ai.name)
+            if "elastic" in self.config:
+                self.save_observation(labels_present, timestamp, fpath)
+
+
+        #if "bird" in labels_present:
+        #    with open("sightings.txt", "a") as f:
+        #        f.write(f"{timestamp}\t{labels_present['bird']}\n")
+        #    self.write_bird_count(labels_present['bird'])
+
+    def save_observation(self, labels_present, timestamp, image_path):
+        threading.Thread(target=self.save_observation_thread, args=[labels_present, timestamp, image_path]).start()
+
+    def save_observation_thread(self, labels_present, timestamp, image_path):
+        if "elastic" in self.config:
+            elastic = self.config["elastic"]
+            index = "detections.images"
+            document = { "@timestamp" : util.timestamp(timestamp), "detections": labels_present, "src_ip": self.config["address"], "file_path": image_path, "type": "image", "model": "darknet.pytorch.yolov7" }
+            uri = f"https://{elastic['address']}:{elastic.get('port', 9200)}/{index}/_doc/"
+            command = f"""curl --cacert {elastic['ca_cert']} -u {elastic['user']}:{elastic['password']} {uri} -H 'Content-Type: application/json' -XPOST -d '{json.dumps(document)}'"""
+            result = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.read().decode("utf8")
+            if "success" in result:
+                print("Successfully recorded observation")
+            else:
+                print("Failed to record observation:", result)
+
+    def elastic_bird_count(self, count):
+        if "elastic" in self.config:
+            elastic = self.config["elastic"]
+            doc_name = self.config_path.replace("config", "bird_count").replace(".", "_")
+            uri = f"https://{elastic['address']}:{elastic.get('port', 9200)}/birds/_doc/{doc_name}"
+            command = f"""curl --cacert {elastic['ca_cert']} -u {elastic['user']}:{elastic['password']} {uri} -H 'Content-Type: application/json' -XPOST -d """ + "'{ \"count\" : " + f"{count}" +  ' }\''
+            result = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.read().decode("utf8")
+            if "updated" in result:
+                print("Successfully updated bird count to", count)
+            else:
+                print("Failed to update bird count:", result, command)
+
+    def write_bird_count(self, count):
+        if "elastic" in self.config:
+            threading.Thread(target=self.elastic_bird_count, args=[count,]).start()
+
+    def update_bird_count(self):
+        count = self.tracker.count("bird")
+        if count != self.bird_count:
+            self.bird_count = count
+            self.write_bird_count(count)
@@ -0,0 +1,75 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+class SamplingProfiler:
+    """
+    Low overhead profiler for a live process (--profile). Every interval it samples the stack of
+    each thread (UI/main loop, capture, AI send, storage) and counts identical stacks. Every
+    flush_interval seconds the counts are written as collapsed stacks, one "thread;outer;...;inner count"
+    line per stack, which flamegraph.pl and speedscope read directly.
+    Detector workers run in their own processes and are not sampled.
+    """
+    def __init__(self, config):
+        self.interval = config.get("profile_interval", 0.01) # seconds between samples
+        self.flush_interval = config.get("profile_flush_interval", 60) # seconds per output file
+        self.directory = config.get("profile_dir", "profiles")
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.flushes = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, name="profiler", daemon=True)
+        self.thread.start()
+        print(f"Profiler: Sampling every {1000*self.interval:.0f}ms, writing to {self.directory}/")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        self.flush()
+
+    def sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)).replace(" ", "_"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def flush(self):
+        if not self.stacks:
+            return
+        # pid and a count so flushes in the same second (e.g. at stop) or from another process don't overwrite each other
+        self.flushes += 1
+        path = os.path.join(self.directory, f"{time.strftime('%y%m%d%H%M%S')}-{os.getpid()}-{self.flushes}.collapsed")
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Profiler: Wrote {self.samples} samples to {path}")
+        self.stacks.clear()
+        self.samples = 0
+
+    def worker(self):
+        last_flush = time.time()
+        while self.running:
+            start = time.time()
+            self.sample()
+            if start - last_flush > self.flush_interval:
+                self.flush()
+                last_flush = start
+            time.sleep(max(0, self.interval - (time.time() - start)))
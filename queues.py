@@ -0,0 +1,15 @@
+import queue
+
+def put_drop_oldest(target, item):
+    # Puts item on a bounded queue without blocking. If it's full, the oldest entries are dropped
+    # to make room and returned as a list, so the caller can count them / release what they hold.
+    dropped = []
+    while True:
+        try:
+            target.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                dropped.append(target.get_nowait())
+            except queue.Empty:
+                pass # a consumer got there first; try again
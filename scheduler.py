@@ -0,0 +1,114 @@
+import threading
+import time
+
+class CameraSchedule:
+    """Inference pacing for one camera, driven by its recent activity and measured latency"""
+    def __init__(self, name, scheduler):
+        self.name = name
+        self.scheduler = scheduler
+        self.rate = scheduler.idle_rate # inferences per second currently granted
+        self.limit = scheduler.active_rate # latency-driven ceiling (AIMD)
+        self.latency = None # smoothed capture-to-result latency (seconds)
+        self.queue_depth = 0
+        self.last_sent = 0
+        self.last_motion = 0
+        self.last_detection = 0
+        self.sent_count = 0
+        self.completed_count = 0
+
+    @property
+    def state(self):
+        now = time.time()
+        if now - self.last_detection < self.scheduler.hold:
+            return "active"
+        if now - self.last_motion < self.scheduler.hold:
+            return "motion"
+        return "idle"
+
+    @property
+    def demand(self):
+        return {"active": self.scheduler.active_rate, "motion": self.scheduler.motion_rate, "idle": self.scheduler.idle_rate}[self.state]
+
+    def ready(self, queue_depth=0):
+        # Whether this camera may send another frame now
+        self.queue_depth = queue_depth
+        self.scheduler.maybe_allocate()
+        return self.rate > 0 and time.time() - self.last_sent >= 1 / self.rate
+
+    def sent(self):
+        self.last_sent = time.time()
+        self.sent_count += 1
+
+    def motion(self):
+        self.last_motion = time.time()
+
+    def completed(self, latency, detections):
+        # Additive increase while the detector keeps up, multiplicative decrease when it falls behind
+        self.completed_count += 1
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if detections:
+            self.last_detection = time.time()
+        if self.latency > self.scheduler.latency_target or self.queue_depth > self.scheduler.max_queue_depth:
+            self.limit = max(self.scheduler.idle_rate, self.limit * 0.8)
+        else:
+            self.limit = min(self.scheduler.active_rate, self.limit + 0.1)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "rate": round(self.rate, 3),
+            "demand": self.demand,
+            "limit": round(self.limit, 3),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "queue_depth": self.queue_depth,
+            "sent": self.sent_count,
+            "completed": self.completed_count,
+        }
+
+class InferenceScheduler:
+    """
+    Sets each camera's inference rate from its activity (birds seen, motion, idle), backs off when
+    end-to-end latency or the detector queue grows, and splits a global inference budget
+    (inferences per second) fairly between cameras with max-min fair sharing.
+    """
+    def __init__(self, config):
+        scheduler = config.get("scheduler", dict())
+        self.budget = scheduler.get("budget", 8.0) # inferences per second shared by all cameras
+        self.active_rate = scheduler.get("active_rate", 4.0) # per camera while birds are present
+        self.motion_rate = scheduler.get("motion_rate", 2.0) # per camera while the scene is changing
+        self.idle_rate = scheduler.get("idle_rate", 1.0) # per camera when nothing is happening
+        self.hold = scheduler.get("hold", 5) # seconds an activity level is kept after the last event
+        self.latency_target = scheduler.get("latency_target", 1.5) # seconds from capture to result
+        self.max_queue_depth = scheduler.get("max_queue_depth", 4) # requests waiting on the detector
+        self.cameras = dict() # name -> CameraSchedule
+        self.lock = threading.Lock()
+        self.last_allocation = 0
+
+    def register(self, name):
+        with self.lock:
+            if name not in self.cameras:
+                self.cameras[name] = CameraSchedule(name, self)
+            schedule = self.cameras[name]
+        self.allocate()
+        return schedule
+
+    def maybe_allocate(self, interval=0.5):
+        if time.time() - self.last_allocation > interval:
+            self.allocate()
+
+    def allocate(self):
+        # Max-min fairness: cameras that want less than an equal share keep what they want,
+        # the rest of the budget is split evenly between the others
+        with self.lock:
+            self.last_allocation = time.time()
+            wants = sorted(self.cameras.values(), key=lambda schedule: min(schedule.demand, schedule.limit))
+            remaining = self.budget
+            for i, schedule in enumerate(wants):
+                share = remaining / (len(wants) - i)
+                schedule.rate = min(schedule.demand, schedule.limit, share)
+                remaining -= schedule.rate
+
+    def status(self):
+        with self.lock:
+            cameras = {name: schedule.status() for name, schedule in self.cameras.items()}
+        return {"budget": self.budget, "allocated": round(sum(camera["rate"] for camera in cameras.values()), 3), "cameras": cameras}
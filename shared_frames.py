@@ -0,0 +1,83 @@
+import sys
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+class SharedFramePool:
+    """
+    Fixed pool of shared-memory slots for handing encoded frames to worker processes.
+    The parent writes a frame into a free slot and only sends (slot, length) over the queue;
+    workers read the bytes straight out of the slot instead of unpickling a copy.
+    A slot on its way to a worker belongs to the workers until one hands it back with done(),
+    even if the parent has given up on the request, so it can't be rewritten while still unread.
+    """
+    def __init__(self, slots, slot_size):
+        self.slot_size = slot_size
+        self.memory = [shared_memory.SharedMemory(create=True, size=slot_size) for _ in range(slots)]
+        self.free = list(range(slots))
+        self.returned = multiprocessing.Queue() # slots the workers have finished reading
+        self.lock = threading.Lock()
+        self.owner = True
+
+    def __getstate__(self):
+        # Only used when workers are spawned rather than forked: send the names and re-attach
+        return {"names": [memory.name for memory in self.memory], "slot_size": self.slot_size, "returned": self.returned}
+
+    def __setstate__(self, state):
+        self.slot_size = state["slot_size"]
+        self.memory = [SharedFramePool.attach(name) for name in state["names"]]
+        self.returned = state["returned"]
+        self.free = []
+        self.lock = threading.Lock()
+        self.owner = False
+
+    @staticmethod
+    def attach(name):
+        # Attach without letting this process's resource tracker unlink the parent's memory on exit
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(name=name, track=False)
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+    def put(self, data):
+        # Copies data into a free slot. Returns (slot, length), or None if it doesn't fit / no slot is free
+        if len(data) > self.slot_size:
+            return None
+        self.collect()
+        with self.lock:
+            if not self.free:
+                return None
+            slot = self.free.pop()
+        self.memory[slot].buf[:len(data)] = data
+        return slot, len(data)
+
+    def get(self, slot, length):
+        return bytes(self.memory[slot].buf[:length])
+
+    def done(self, slot):
+        # Called by a worker once it has read (or skipped) a slot
+        self.returned.put(slot)
+
+    def collect(self):
+        # Free the slots the workers have handed back
+        while True:
+            try:
+                self.release(self.returned.get_nowait())
+            except queue.Empty:
+                return
+
+    def release(self, slot):
+        if slot is None:
+            return
+        with self.lock:
+            if slot not in self.free:
+                self.free.append(slot)
+
+    def close(self):
+        for memory in self.memory:
+            memory.close()
+            if self.owner:
+                memory.unlink()
+        self.memory = []
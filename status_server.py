@@ -0,0 +1,60 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StatusServer:
+    """
+    Small local HTTP server for runtime status.
+    Components register a provider function under a path, e.g. add("/status", scheduler.status);
+    dict results are served as JSON, strings as plain text, and (content type, bytes) tuples as is.
+    """
+    def __init__(self, port, address="127.0.0.1"):
+        self.routes = dict()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                provider = server.routes.get(self.path.split("?")[0])
+                if provider is None:
+                    self.send_error(404)
+                    return
+                try:
+                    result = provider()
+                    if result is None:
+                        self.send_error(503) # nothing to show yet, e.g. no frame captured
+                        return
+                    content_type, body = server.render(result)
+                except Exception as err:
+                    self.send_error(500, str(err))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # keep request logs out of the console
+
+        self.httpd = ThreadingHTTPServer((address, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="status server", daemon=True)
+
+    def add(self, path, provider):
+        self.routes[path] = provider
+
+    def render(self, result):
+        if isinstance(result, tuple):
+            return result
+        if isinstance(result, bytes):
+            return "application/octet-stream", result
+        if isinstance(result, str):
+            return "text/plain; charset=utf-8", result.encode("utf8")
+        return "application/json", json.dumps(result, indent=2).encode("utf8")
+
+    def start(self):
+        self.thread.start()
+        print(f"Status server listening on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}")
+
+    def stop(self):
+        self.httpd.shutdown()
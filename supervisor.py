@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import signal
+import sys
+import time
+
+import util
+from camera import Camera
+from ai import AI, DetectorPool
+from pipeline import Alerts, Pipeline, Storage
+from scheduler import InferenceScheduler
+from profiler import SamplingProfiler
+from status_server import StatusServer
+import latency
+import metrics
+
+class Supervisor:
+    """
+    Runs one or more cameras in one process without a window, e.g. python3 supervisor.py .config .front.config
+    Every camera gets its own capture, motion gate and tracker, but they all share one set of
+    detector workers, one inference scheduler (which splits the budget fairly between them),
+    one storage writer and one set of alerts. Shared settings (detector, scheduler, hue, audio,
+    status server) are read from the first config.
+    """
+    def __init__(self, configs):
+        shared = configs[0]
+        self.scheduler = InferenceScheduler(shared)
+        self.pool = DetectorPool(shared)
+        self.alerts = Alerts(shared)
+        self.storage = Storage()
+        self.loop_interval = shared.get("supervisor_interval", 0.02) # seconds between passes over the cameras
+        self.running = False
+        latency.histograms.window = shared.get("latency_window", 60) # seconds of samples behind each percentile
+        latency.histograms.start_logging(shared.get("latency_log_interval", 0)) # seconds between log lines, 0 for none
+
+        self.pipelines = []
+        for CONFIG in configs:
+            cam = Camera(CONFIG)
+            ai = AI(CONFIG, self.scheduler, self.pool)
+            self.pipelines.append(Pipeline(CONFIG, cam, ai, self.alerts, self.storage))
+            print(f"Supervisor: Started camera {ai.name}")
+
+        self.status_server = None
+        if "status_port" in shared:
+            self.status_server = StatusServer(shared["status_port"], shared.get("status_address", "127.0.0.1"))
+            self.status_server.add("/status", self.scheduler.status)
+            self.status_server.add("/ai", self.status)
+            self.status_server.add("/latency", latency.histograms.summary)
+            self.status_server.add("/metrics", metrics.registry.render)
+            # Viewers (viewer.py) attach through these; the first camera is also served at the top level
+            for path, pipeline in [("", self.pipelines[0])] + [(f"/{pipeline.ai.name}", pipeline) for pipeline in self.pipelines]:
+                self.status_server.add(f"{path}/snapshot.jpg", pipeline.snapshot)
+                self.status_server.add(f"{path}/tracks", pipeline.tracks)
+            self.status_server.start()
+
+    def status(self):
+        return {
+            "detector": self.pool.status(),
+            "storage_dropped": self.storage.dropped,
+            "cameras": {pipeline.ai.name: pipeline.ai.status() for pipeline in self.pipelines},
+        }
+
+    def run(self):
+        self.running = True
+        while self.running:
+            start = time.time()
+            for pipeline in self.pipelines:
+                try:
+                    pipeline.step()
+                    pipeline.check_connection()
+                except Exception as err:
+                    # One misbehaving camera shouldn't take the others down
+                    print(f"Supervisor: Error in camera {pipeline.ai.name}:", err)
+            self.pool.check_connection()
+            delay = self.loop_interval - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self):
+        self.running = False
+        if self.status_server:
+            self.status_server.stop()
+        for pipeline in self.pipelines:
+            pipeline.stop()
+            pipeline.ai.stop()
+            pipeline.cam.stop_capture()
+            if pipeline.cam.rtsp:
+                pipeline.cam.rtsp.close()
+        self.pool.stop()
+
+def serve(configs, profile=False):
+    # Runs until interrupted or terminated (e.g. by systemd), then shuts the workers down cleanly
+    supervisor = Supervisor(configs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: setattr(supervisor, "running", False))
+    profiler = SamplingProfiler(configs[0]) if profile else None
+    if profiler:
+        profiler.start()
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        pass
+    supervisor.stop()
+    if profiler:
+        profiler.stop()
+
+def main():
+    # --profile samples every thread and writes collapsed stacks (see profiler.py)
+    paths = [arg for arg in sys.argv[1:] if arg != "--profile"] or [".config"]
+    serve([util.load_config(path) for path in paths], "--profile" in sys.argv[1:])
+
+if __name__ == "__main__":
+    main()
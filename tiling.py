@@ -0,0 +1,97 @@
+import math
+
+import cv2
+
+def iou(a, b):
+    # Intersection over union of two (x, y, w, h) center-based boxes
+    ax1, ay1, ax2, ay2 = a[0] - a[2]/2, a[1] - a[3]/2, a[0] + a[2]/2, a[1] + a[3]/2
+    bx1, by1, bx2, by2 = b[0] - b[2]/2, b[1] - b[3]/2, b[0] + b[2]/2, b[1] + b[3]/2
+    w = min(ax2, bx2) - max(ax1, bx1)
+    h = min(ay2, by2) - max(ay1, by1)
+    if w <= 0 or h <= 0:
+        return 0.0
+    intersection = w * h
+    return intersection / (a[2]*a[3] + b[2]*b[3] - intersection)
+
+def roi_region(roi, frame_size):
+    # Pixel region (x, y, w, h) for a normalized region of interest, or the whole frame
+    width, height = frame_size
+    if not roi:
+        return 0, 0, width, height
+    x, y, w, h = roi
+    x, y = int(max(0, x) * width), int(max(0, y) * height)
+    return x, y, max(1, min(int(w * width), width - x)), max(1, min(int(h * height), height - y))
+
+def map_detections(detections, region, frame_size):
+    # Maps detections normalized to a region (x, y, w, h in pixels) of the frame back to normalized frame coordinates
+    rx, ry, rw, rh = region
+    width, height = frame_size
+    mapped = []
+    for label, confidence, (x, y, w, h) in detections:
+        mapped.append((label, confidence, ((rx + x*rw) / width, (ry + y*rh) / height, w*rw / width, h*rh / height)))
+    return mapped
+
+def merge_detections(detections, threshold=0.45):
+    # Greedy per-label non-maximum suppression, used to merge boxes found in several overlapping tiles
+    merged = []
+    for detection in sorted(detections, key=lambda d: d[1], reverse=True):
+        label, confidence, rect = detection
+        if all(other[0] != label or iou(rect, other[2]) < threshold for other in merged):
+            merged.append(detection)
+    return merged
+
+class Tiler:
+    """
+    Cuts full resolution frames into overlapping, network-sized tiles so small, distant birds
+    keep enough pixels, and merges the per-tile detections back into full frame coordinates.
+    Configured per camera with the "tiling" config section.
+    """
+    def __init__(self, config, input_size):
+        tiling = config.get("tiling", dict())
+        self.enabled = tiling.get("enabled", False)
+        self.scale = max(0.1, tiling.get("scale", 1.0)) # frame pixels per network pixel; above 1 gives fewer, downscaled tiles
+        self.overlap = min(0.9, max(0, tiling.get("overlap", 0.2))) # least fraction of a tile shared with its neighbour
+        self.include_full = tiling.get("include_full", True) # also run the whole (squashed) frame for large birds
+        self.nms = tiling.get("nms", 0.45)
+        self.input_size = tuple(input_size or (608, 608))
+        self.layouts = dict() # frame size -> tile regions
+
+    def layout(self, frame_size, roi=None):
+        # Pixel regions (x, y, w, h) of the tiles covering a frame of this size, or just its region of interest.
+        # Tiles are the network input size (times scale) in frame pixels, so they reach the network unsquashed;
+        # the grid is as many tiles as it takes to cover the frame with at least overlap between neighbours.
+        key = frame_size, roi
+        if key not in self.layouts:
+            offset_x, offset_y, width, height = roi_region(roi, frame_size)
+            tile_width = min(width, int(round(self.input_size[0] * self.scale)))
+            tile_height = min(height, int(round(self.input_size[1] * self.scale)))
+            regions = [(offset_x + x, offset_y + y, tile_width, tile_height)
+                       for y in self.positions(height, tile_height) for x in self.positions(width, tile_width)]
+            if self.include_full and len(regions) > 1:
+                regions.append((offset_x, offset_y, width, height))
+            self.layouts[key] = regions
+        return self.layouts[key]
+
+    def positions(self, length, tile):
+        # Tile offsets along one side, spread evenly from edge to edge
+        if tile >= length:
+            return [0]
+        count = math.ceil((length - tile) / (tile * (1 - self.overlap))) + 1
+        step = (length - tile) / (count - 1)
+        return [int(round(i * step)) for i in range(count)]
+
+    def encode(self, image, regions, quality=90):
+        # JPEG encodes every region of a cv2 (BGR) image at the network input size
+        tiles = []
+        for x, y, w, h in regions:
+            tile = cv2.resize(image[y:y+h, x:x+w], self.input_size, interpolation=cv2.INTER_AREA)
+            tiles.append(cv2.imencode(".jpg", tile, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+        return tiles
+
+    def merge(self, detections_per_tile, regions, frame_size):
+        detections = []
+        for tile_detections, region in zip(detections_per_tile, regions):
+            detections.extend(map_detections(tile_detections, region, frame_size))
+        if len(regions) == 1:
+            return detections
+        return merge_detections(detections, self.nms)
@@ -0,0 +1,101 @@
+import itertools
+
+from tiling import iou
+
+class Track:
+    """A single object followed across detection results, with a constant-velocity motion model"""
+    def __init__(self, track_id, label, confidence, rect, timestamp):
+        self.id = track_id
+        self.label = label
+        self.confidence = confidence
+        self.max_confidence = confidence
+        self.rect = rect # (x, y, w, h) normalized, center based
+        self.velocity = (0.0, 0.0) # normalized units per second
+        self.start = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+        self.events = set() # one-off actions already taken for this track (alerts, chirps)
+        self.last_saved = None
+
+    def once(self, event):
+        # True the first time it's called for an event, so each track only triggers it once
+        if event in self.events:
+            return False
+        self.events.add(event)
+        return True
+
+    def predict(self, timestamp):
+        # Where the box should be at timestamp, assuming it keeps moving as it was (for at most a second)
+        dt = min(1.0, max(0, timestamp - self.last_seen))
+        x, y, w, h = self.rect
+        return (x + self.velocity[0]*dt, y + self.velocity[1]*dt, w, h)
+
+    def update(self, confidence, rect, timestamp, smoothing):
+        # Blend the new detection with the prediction (alpha-beta filter)
+        dt = timestamp - self.last_seen
+        predicted = self.predict(timestamp)
+        smoothed = tuple(smoothing*p + (1 - smoothing)*r for p, r in zip(predicted, rect))
+        if dt > 0:
+            self.velocity = tuple(smoothing*v + (1 - smoothing)*(s - o)/dt for v, s, o in zip(self.velocity, smoothed[:2], self.rect[:2]))
+        self.rect = smoothed
+        self.confidence = confidence
+        self.max_confidence = max(self.max_confidence, confidence)
+        self.last_seen = max(self.last_seen, timestamp)
+        self.hits += 1
+
+class Tracker:
+    """
+    SORT-style tracker: matches each detection batch to existing tracks by IoU, so the same bird
+    keeps one track ID while it stays in view. Tracks that go unseen for max_age seconds end.
+    """
+    def __init__(self, config):
+        tracking = config.get("tracking", dict())
+        self.iou_threshold = tracking.get("iou_threshold", 0.3)
+        self.max_age = tracking.get("max_age", 5) # seconds without a detection before a track ends
+        self.smoothing = tracking.get("smoothing", 0.3) # weight of the prediction against a new detection
+        self.tracks = dict() # id -> Track
+        self.ids = itertools.count(1)
+
+    def update(self, detections, timestamp):
+        # Returns (tracks matched or started by these detections, started tracks)
+        candidates = []
+        for i, (label, confidence, rect) in enumerate(detections):
+            for track in self.tracks.values():
+                if track.label == label:
+                    overlap = iou(track.predict(timestamp), rect)
+                    if overlap >= self.iou_threshold:
+                        candidates.append((overlap, i, track.id))
+
+        # Greedily pair the best overlaps first
+        matched = dict() # detection index -> track
+        for overlap, i, track_id in sorted(candidates, reverse=True):
+            if i in matched or any(track.id == track_id for track in matched.values()):
+                continue
+            matched[i] = self.tracks[track_id]
+
+        updated = []
+        started = []
+        for i, (label, confidence, rect) in enumerate(detections):
+            if i in matched:
+                track = matched[i]
+                track.update(confidence, rect, timestamp, self.smoothing)
+            else:
+                track = Track(next(self.ids), label, confidence, rect, timestamp)
+                self.tracks[track.id] = track
+                started.append(track)
+            updated.append(track)
+        return updated, started
+
+    def expire(self, timestamp):
+        # Ends and returns the tracks that haven't been seen for max_age seconds
+        ended = [track for track in self.tracks.values() if timestamp - track.last_seen > self.max_age]
+        for track in ended:
+            del self.tracks[track.id]
+        return ended
+
+    def boxes(self, timestamp):
+        # Smoothed (label, confidence, rect) boxes of the live tracks, predicted to timestamp
+        return [(track.label, track.confidence, track.predict(timestamp)) for track in self.tracks.values()]
+
+    def count(self, label):
+        return sum(1 for track in self.tracks.values() if track.label == label)
@@ -5,7 +5,6 @@ from PIL import Image
 import cv2
 import numpy as np
 import io
-import pygame
 from datetime import datetime   
 import pytz
 
@@ -67,10 +66,13 @@ def load_config(path):
     return config
 
 
-def save_xml(boxes, path):
+def camera_name(config):
+    # Short name for a camera in logs and status, e.g. ".front.config"
+    return config.get("name", os.path.basename(config.get("config_path", "camera")))
+
+def save_xml(boxes, path, size=(2560, 1440)):
     filename = path.split("/")[-1]
-    width = 2560
-    height = 1440
+    width, height = size
     object_template = lambda label, rect: f"""<object>
         <name>{label}</name>
         <pose>Unspecified</pose>
@@ -106,6 +108,7 @@ def save_xml(boxes, path):
 
     with open(path.replace(".jpg", ".xml"), "w") as f:
         f.write(output)
+    return len(output.encode("utf8"))
 
 def convert_image(image, output_format):
     # Convert images between formats. Supported output_formats:
@@ -125,6 +128,7 @@ def convert_image(image, output_format):
                 mode = image.mode
                 size = image.size
                 data = image.tobytes()
+                import pygame # not needed without a display
                 return pygame.image.fromstring(data, size, mode)
             elif output_format.lower()=="cv2":
                 return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
@@ -135,21 +139,25 @@ def convert_image(image, output_format):
             if output_format == "numpy":
                 return cv2.imdecode(np.frombuffer(image, np.uint8), -1)
             elif output_format == "pygame":
+                import pygame
                 return pygame.image.load(io.BytesIO(image))
             elif output_format == "cv2":
-                return cv2.imdecode(np.fromstring(image, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+                return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
         elif type(image).__name__ == "ndarray":
             if output_format == "pygame":
+                import pygame
                 return pygame.surfarray.make_surface(image)
             elif output_format.lower() in ("jpg", "jpeg"):
                 im = Image.fromarray(image)
                 return convert_image(im, output_format)
         elif type(image).__name__ == "Surface":
             if output_format.lower() == "cv2":
+                import pygame
                 view = pygame.surfarray.array3d(image)
                 view = view.transpose([1, 0, 2])
                 return cv2.cvtColor(view, cv2.COLOR_RGB2BGR)
             elif output_format.lower() in ("jpg", "jpeg"):
+                import pygame
                 img_byte_arr = io.BytesIO()
                 pygame.image.save(image, img_byte_arr)
                 return img_byte_arr.getvalue()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import threading
+import time
+import requests
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import pygame
+
+class Viewer:
+    """
+    Read-only window onto a headless service (application.py --headless, or supervisor.py).
+    Polls the latest snapshot and live tracks from the status server and draws them; closing
+    the viewer leaves the service running.
+    e.g. python3 viewer.py http://127.0.0.1:8080 [camera name]
+    """
+    BLACK = (0,0,0)
+    PINK = (245, 115, 158)
+    RED = (255, 30, 30)
+
+    def __init__(self, address, camera=None, interval=0.2):
+        self.url = address.rstrip("/") + (f"/{camera}" if camera else "")
+        self.interval = interval # seconds between snapshots
+        self.session = requests.Session()
+        self.image = None
+        self.boxes = []
+        self.error = None
+        self.running = True
+
+        pygame.init()
+        pygame.font.init()
+        self.font = pygame.font.SysFont('Consolas', 30)
+        self.display_size = 800,448
+        self.display = pygame.display.set_mode(self.display_size, pygame.RESIZABLE)
+        pygame.display.set_caption(f'Bird Cam Viewer - {self.url}')
+        self.GOOD_BIRD = self.font.render(f'good bird', False, Viewer.PINK)
+        threading.Thread(target=self.poll, daemon=True).start()
+
+    def poll(self):
+        # Fetch in the background so a slow service doesn't freeze the window
+        while self.running:
+            start = time.time()
+            try:
+                snapshot = self.session.get(self.url + "/snapshot.jpg", timeout=5)
+                if snapshot.status_code == 200:
+                    self.image = pygame.image.load(io.BytesIO(snapshot.content))
+                self.boxes = self.session.get(self.url + "/tracks", timeout=5).json()["boxes"]
+                self.error = None
+            except Exception as err:
+                self.error = str(err)
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def draw(self):
+        self.display.fill(Viewer.BLACK)
+        if self.image is not None:
+            self.display.blit(pygame.transform.scale(self.image, self.display_size), (0, 0))
+        for label, confidence, (x, y, w, h) in self.boxes:
+            rect = ((x-w/2)*self.display_size[0], (y-h/2)*self.display_size[1], w*self.display_size[0], h*self.display_size[1])
+            pygame.draw.rect(self.display, Viewer.PINK, rect, width=2)
+            if label == "bird":
+                self.display.blit(self.GOOD_BIRD, (rect[0], rect[1]))
+        if self.error:
+            self.display.blit(self.font.render("Service unavailable", False, Viewer.RED), (10, 200))
+        pygame.display.flip()
+
+    def run(self):
+        clock = pygame.time.Clock()
+        while self.running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_q):
+                    self.running = False
+            self.display_size = pygame.display.get_surface().get_size()
+            self.draw()
+            clock.tick(30)
+        pygame.quit()
+
+def main():
+    address = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8080"
+    camera = sys.argv[2] if len(sys.argv) > 2 else None
+    Viewer(address, camera).run()
+
+if __name__ == "__main__":
+    main()